@@ -1,11 +1,26 @@
 import os
 import json
+import logging
 import re
+import io
+import mmap
+import gzip
+import time
+import hmac
+import hashlib
+import cProfile
+import pstats
+import random
+import threading
+from concurrent.futures import Future
+from array import array
+from collections import Counter, OrderedDict, deque
 import numpy as np
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g, send_from_directory
 from flask_cors import CORS
 from sklearn.feature_extraction.text import TfidfVectorizer
 import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
 from sentence_transformers import SentenceTransformer
 import chromadb
 import fitz
@@ -14,8 +29,77 @@ import fitz
 
 UPLOAD_DIR = "./uploads"
 CHROMA_DIR = "./chroma_store"
+TEXT_STORE_DIR = os.getenv("TEXT_STORE_DIR", "./text_store")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
+# Defaults for new collections; existing ones keep the settings they were built with
+EMBED_MODEL = os.getenv("EMBED_MODEL", "all-MiniLM-L6-v2")
+CHUNK_SIZE = 500
+CHUNK_OVERLAP = 50
+# "sentences" packs whole sentences across page breaks; "words" is the
+# original fixed word window per page
+CHUNKER = os.getenv("CHUNKER", "sentences")
+DEFAULT_COLLECTION = "docs"
+ADD_BATCH_SIZE = 1000  # chunks per Chroma add call
+
+# Each worker switches to the collection reindex.py activates, checking the
+# active_collection file at most this often (seconds). POST /reload switches
+# the worker that serves it at once and needs the X-Admin-Token header.
+ACTIVE_CHECK_INTERVAL = float(os.getenv("ACTIVE_CHECK_INTERVAL", 5))
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+# Two-stage retrieval: route the query to the ROUTE_DOCS best documents (by
+# centroid embedding), optionally to the ROUTE_PAGES best pages within them,
+# then search chunks only there. 0 = flat search over every chunk.
+ROUTE_DOCS = int(os.getenv("ROUTE_DOCS", 0))
+ROUTE_PAGES = int(os.getenv("ROUTE_PAGES", 0))
+
+# LLM call scheduling: at most LLM_MAX_CONCURRENCY Gemini calls at once and
+# LLM_MAX_QUEUE more waiting (up to LLM_QUEUE_TIMEOUT s); beyond that -> 503
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 8))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", 32))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", 30))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 4))
+LLM_BACKOFF_BASE = 0.5   # seconds; doubled per retry, full jitter
+LLM_BACKOFF_MAX = 8.0
+
+# If set, chunk texts loaded at startup are written here and memory-mapped,
+# so worker processes share one copy through the page cache
+CHUNK_STORE_DIR = os.getenv("CHUNK_STORE_DIR")
+
+# Vector search backend: "chroma" (float32 HNSW) or "int8" (in-process scan of
+# scalar-quantized embeddings saved under QUANT_INDEX_DIR and memory-mapped, so
+# float vectors are not loaded). QUANT_RERANK_K > 0 re-scores that many int8
+# candidates with float embeddings from Chroma, which loads Chroma's float
+# index into the process and gives up most of the memory saving.
+VECTOR_INDEX = os.getenv("VECTOR_INDEX", "chroma")
+QUANT_INDEX_DIR = os.getenv("QUANT_INDEX_DIR", "./quant_index")
+QUANT_RERANK_K = int(os.getenv("QUANT_RERANK_K", 0))
+
+# Search traces (per-stage timings and candidates): returned by /search with
+# explain=true, and logged as JSON lines for a sampled fraction of searches
+SEARCH_TRACE_RATE = float(os.getenv("SEARCH_TRACE_RATE", 0))
+SEARCH_TRACE_LOG = os.getenv("SEARCH_TRACE_LOG")   # file path; default stderr
+
+# Context assembly for the summarization prompt
+CONTEXT_FETCH_K = 10   # hybrid candidates considered
+CONTEXT_TOP_K = 5      # chunks kept after MMR
+MMR_LAMBDA = 0.7       # 1.0 = pure relevance, 0.0 = pure diversity
+
+# Semantic query cache (near-duplicate queries reuse results)
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", 256))
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.9))
+
+# Request profiling: per request with "X-Profile: <PROFILE_TOKEN>",
+# or every request with PROFILE_ALL_REQUESTS=1
+PROFILE_DIR = os.getenv("PROFILE_DIR", "./profiles")
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN")
+PROFILE_ALL_REQUESTS = os.getenv("PROFILE_ALL_REQUESTS") == "1"
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", 200))   # oldest deleted first
+if PROFILE_ALL_REQUESTS and not PROFILE_TOKEN:
+    # Profiles could be written but never listed or downloaded
+    raise RuntimeError("PROFILE_ALL_REQUESTS=1 requires PROFILE_TOKEN")
+
 # Use environment variable for API key (for deployment)
 genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
 
@@ -38,6 +122,680 @@ def chunk_text(text, size=500, overlap=50):
         chunks.append(" ".join(words[i:i + size]))
     return chunks
 
+# A run of text ending in . ! or ? (plus closing quotes/brackets) before a
+# space, or the rest of the text
+SENTENCE = re.compile(r"\S.*?(?:[.!?][\"')\]]*(?= )|$)")
+
+def iter_sentences(pages):
+    """
+    Yield (first_page, last_page, sentence) from page texts in order
+    (1-based pages). A sentence cut by a page break is joined with its end.
+    """
+    carry = None
+    for number, raw in enumerate(pages, 1):
+        for match in SENTENCE.finditer(clean_text(raw)):
+            sentence, first = match.group(), number
+            if carry:
+                first, sentence = carry[0], carry[2] + " " + sentence
+                carry = None
+            if sentence.rstrip("\"')]")[-1:] in (".", "!", "?"):
+                yield first, number, sentence
+            else:
+                carry = (first, number, sentence)
+    if carry:
+        yield carry
+
+def chunk_sentences(pages, size=500, overlap=50):
+    """
+    Pack whole sentences into chunks of at most size words, streaming across
+    page boundaries. Each chunk starts with the trailing sentences of the
+    previous one, up to overlap words; a sentence longer than size is split
+    with chunk_text. Yields (text, first_page, last_page).
+    """
+    window, words, fresh = deque(), 0, False
+    for first, last, sentence in iter_sentences(pages):
+        n = sentence.count(" ") + 1
+        if n > size:
+            if fresh:
+                yield " ".join(s for _, _, s, _ in window), window[0][0], window[-1][1]
+            for piece in chunk_text(sentence, size, overlap):
+                yield piece, first, last
+            window, words, fresh = deque(), 0, False
+            continue
+
+        if fresh and words + n > size:
+            yield " ".join(s for _, _, s, _ in window), window[0][0], window[-1][1]
+            kept, words = deque(), 0
+            while window and words + window[-1][3] <= overlap:
+                kept.appendleft(window.pop())
+                words += kept[0][3]
+            window = kept
+        while window and words + n > size:
+            words -= window.popleft()[3]
+
+        window.append((first, last, sentence, n))
+        words += n
+        fresh = True
+    if fresh:
+        yield " ".join(s for _, _, s, _ in window), window[0][0], window[-1][1]
+
+def chunk_document(name, doc_hash, pages, size=CHUNK_SIZE, overlap=CHUNK_OVERLAP, chunker=CHUNKER):
+    """
+    Chunk a document's extracted page texts
+    Returns (ids, texts, metadatas) ready for the vector store; "page" is the
+    page a chunk starts on and "page_end" the page it ends on
+    """
+    ids, texts, metas = [], [], []
+    if chunker == "words":
+        for number, raw in enumerate(pages):
+            for i, chunk in enumerate(chunk_text(clean_text(raw), size, overlap)):
+                ids.append(f"{name}_{number}_{i}")
+                texts.append(chunk)
+                metas.append({"doc": name, "page": number + 1, "page_end": number + 1,
+                              "chunk": i, "doc_hash": doc_hash})
+        return ids, texts, metas
+
+    # Running headers/footers would otherwise land mid-sentence at page breaks
+    patterns = find_boilerplate(pages)
+    if patterns:
+        pages = [strip_boilerplate(page, patterns) for page in pages]
+
+    # Chunks are numbered through the document, not per page
+    for i, (chunk, first, last) in enumerate(chunk_sentences(pages, size, overlap)):
+        ids.append(f"{name}_{first - 1}_{i}")
+        texts.append(chunk)
+        metas.append({"doc": name, "page": first, "page_end": last,
+                      "chunk": i, "doc_hash": doc_hash})
+    return ids, texts, metas
+
+def add_chunks(collection, ids, texts, embeddings, metas, upsert=False):
+    """Write chunks to Chroma in batches below its per-call limit"""
+    write = collection.upsert if upsert else collection.add
+    for start in range(0, len(ids), ADD_BATCH_SIZE):
+        end = start + ADD_BATCH_SIZE
+        write(
+            ids=ids[start:end],
+            documents=texts[start:end],
+            embeddings=np.asarray(embeddings[start:end]).tolist(),
+            metadatas=metas[start:end]
+        )
+
+def centroid_collections(client, name):
+    """Collections holding document- and page-level centroids for collection name"""
+    return (client.get_or_create_collection(f"{name}.doc-centroids"),
+            client.get_or_create_collection(f"{name}.page-centroids"))
+
+def add_centroids(doc_collection, page_collection, embeddings, metas):
+    """
+    Store the normalized mean chunk embedding of every document and page
+    in metas as its routing representative
+    """
+    embs = np.asarray(embeddings, dtype=np.float32)
+    if not len(embs):
+        return
+    embs = embs / (np.linalg.norm(embs, axis=1, keepdims=True) + 1e-10)
+
+    # A chunk spanning pages counts towards each page it covers
+    groups = {"doc": {}, "page": {}}
+    for i, meta in enumerate(metas):
+        groups["doc"].setdefault(meta["doc"], []).append(i)
+        for page in range(meta["page"], meta.get("page_end", meta["page"]) + 1):
+            groups["page"].setdefault((meta["doc"], page), []).append(i)
+
+    for level, target in (("doc", doc_collection), ("page", page_collection)):
+        ids, vectors, level_metas = [], [], []
+        for key, rows in groups[level].items():
+            centroid = embs[rows].mean(axis=0)
+            vectors.append(centroid / (np.linalg.norm(centroid) + 1e-10))
+            if level == "doc":
+                ids.append(key)
+                level_metas.append({"doc": key, "chunks": len(rows)})
+            else:
+                ids.append(f"{key[0]}#{key[1]}")
+                level_metas.append({"doc": key[0], "page": key[1], "chunks": len(rows)})
+        for start in range(0, len(ids), ADD_BATCH_SIZE):
+            end = start + ADD_BATCH_SIZE
+            target.upsert(ids=ids[start:end], embeddings=np.asarray(vectors[start:end]).tolist(),
+                          metadatas=level_metas[start:end])
+
+# ---------------- TEXT STORE ----------------
+
+def file_hash(path):
+    """SHA-256 of a file's contents"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+class TextStore:
+    """
+    Extracted page text per document, stored as gzip-compressed JSON keyed
+    by the SHA-256 of the source PDF, so indexes can be rebuilt with new
+    chunking or embedding settings without re-uploading anything
+    """
+    def __init__(self, root=TEXT_STORE_DIR):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, doc_hash):
+        return os.path.join(self.root, f"{doc_hash}.json.gz")
+
+    def has(self, doc_hash):
+        return os.path.exists(self.path(doc_hash))
+
+    def put(self, doc_hash, name, pages):
+        """Store a document's page texts (atomic; re-uploads overwrite the name)"""
+        tmp = self.path(doc_hash) + ".tmp"
+        with gzip.open(tmp, "wt", encoding="utf-8") as f:
+            json.dump({"hash": doc_hash, "name": name, "pages": pages}, f)
+        os.replace(tmp, self.path(doc_hash))
+
+    def get(self, doc_hash):
+        """{"hash", "name", "pages"} for a stored document"""
+        with gzip.open(self.path(doc_hash), "rt", encoding="utf-8") as f:
+            return json.load(f)
+
+    def name(self, doc_hash):
+        """A stored document's name, without decoding its pages"""
+        with gzip.open(self.path(doc_hash), "rt", encoding="utf-8") as f:
+            head = f.read(4096)
+            while ', "pages": ' not in head:
+                more = f.read(4096)
+                if not more:
+                    break
+                head += more
+        return json.loads(head[:head.index(', "pages": ')] + "}")["name"]
+
+    def hashes(self):
+        """Hashes of every stored document, sorted"""
+        return sorted(
+            name[:-len(".json.gz")] for name in os.listdir(self.root)
+            if name.endswith(".json.gz")
+        )
+
+def active_collection(chroma_dir=CHROMA_DIR):
+    """Name of the collection the server should search"""
+    try:
+        with open(os.path.join(chroma_dir, "active_collection")) as f:
+            return f.read().strip() or DEFAULT_COLLECTION
+    except FileNotFoundError:
+        return DEFAULT_COLLECTION
+
+def set_active_collection(name, chroma_dir=CHROMA_DIR):
+    """Atomically point the server at another collection"""
+    os.makedirs(chroma_dir, exist_ok=True)
+    path = os.path.join(chroma_dir, "active_collection")
+    with open(path + ".tmp", "w") as f:
+        f.write(name)
+    os.replace(path + ".tmp", path)
+
+# ---------------- CHUNK STORE ----------------
+
+def chunk_key(chunk_id):
+    """64-bit key for a chunk id, so lookups don't need a dict of strings"""
+    return int.from_bytes(hashlib.blake2b(chunk_id.encode("utf-8"), digest_size=8).digest(),
+                          "little", signed=True)
+
+def chunk_position(chunk_id, meta):
+    """(doc, page, chunk, page_end) from metadata, parsing the id for older collections"""
+    meta = meta or {}
+    chunk = meta.get("chunk")
+    if chunk is None:
+        chunk = int(chunk_id.rsplit("_", 1)[-1])
+    page = meta.get("page", 0)
+    return meta.get("doc", ""), page, chunk, meta.get("page_end", page)
+
+class ChunkStore:
+    """
+    Chunk texts in one contiguous UTF-8 buffer with an offsets array, plus
+    compact doc/page/chunk columns. Both retrievers refer to chunks by row
+    number and text is decoded only for the results actually returned, so
+    memory grows with bytes of text rather than with the number of chunks.
+    """
+    def __init__(self):
+        self.base = b""            # frozen (optionally memory-mapped) prefix
+        self.tail = bytearray()    # text appended after the last freeze
+        self.offsets = array("q", [0])
+        self.doc_idx = array("i")
+        self.pages = array("i")
+        self.page_ends = array("i")
+        self.chunks = array("i")
+        self.keys = array("q")
+        self.doc_names = []
+        self._doc_rows = {}
+        self._sorted = None        # (sorted keys, rows) for id lookup
+        self._by_doc = None        # (rows grouped by doc, group bounds, pages) for routing
+
+    def __len__(self):
+        return len(self.doc_idx)
+
+    def append(self, chunk_id, text, doc, page, chunk, page_end=None):
+        """Add a chunk and return its row"""
+        if doc not in self._doc_rows:
+            self._doc_rows[doc] = len(self.doc_names)
+            self.doc_names.append(doc)
+        self.tail += text.encode("utf-8")
+        self.offsets.append(len(self.base) + len(self.tail))
+        self.doc_idx.append(self._doc_rows[doc])
+        self.pages.append(page)
+        self.page_ends.append(page if page_end is None else page_end)
+        self.chunks.append(chunk)
+        self.keys.append(chunk_key(chunk_id))
+        self._sorted = None
+        self._by_doc = None
+        return len(self) - 1
+
+    def text(self, row):
+        start, end = self.offsets[row], self.offsets[row + 1]
+        base = len(self.base)
+        if start >= base:
+            return bytes(self.tail[start - base:end - base]).decode("utf-8")
+        return bytes(self.base[start:end]).decode("utf-8")
+
+    def iter_texts(self):
+        """Decode chunks one at a time (e.g. to fit TF-IDF without a list of strings)"""
+        for row in range(len(self)):
+            yield self.text(row)
+
+    def chunk_id(self, row):
+        doc = self.doc_names[self.doc_idx[row]]
+        return f"{doc}_{self.pages[row] - 1}_{self.chunks[row]}"
+
+    def record(self, row):
+        """Chunk record {"row", "id", "text", "doc", "page", "page_end", "chunk"}"""
+        doc = self.doc_names[self.doc_idx[row]]
+        page, chunk = self.pages[row], self.chunks[row]
+        return {
+            "row": row,
+            "id": self.chunk_id(row),
+            "text": self.text(row),
+            "doc": doc,
+            "page": page,
+            "page_end": self.page_ends[row],
+            "chunk": chunk
+        }
+
+    def row_of(self, chunk_id):
+        """Row for a chunk id, or None"""
+        if self._sorted is None:
+            # Copy rather than view the array so later appends can still resize it
+            keys = np.array(self.keys, dtype=np.int64)
+            order = np.argsort(keys, kind="stable")
+            self._sorted = (keys[order], order)
+        keys, order = self._sorted
+        key = chunk_key(chunk_id)
+        i = int(np.searchsorted(keys, key))
+        return int(order[i]) if i < len(keys) and keys[i] == key else None
+
+    def rows_for(self, docs, pages=None):
+        """Sorted rows of the named documents, or only of the given (doc, page) pairs"""
+        if self._by_doc is None:
+            doc_idx = np.array(self.doc_idx, dtype=np.int64)
+            order = np.argsort(doc_idx, kind="stable")
+            bounds = np.searchsorted(doc_idx[order], np.arange(len(self.doc_names) + 1))
+            self._by_doc = (order, bounds, doc_idx, np.array(self.pages, dtype=np.int64),
+                            np.array(self.page_ends, dtype=np.int64))
+        order, bounds, doc_col, page_col, end_col = self._by_doc
+
+        groups = [order[bounds[d]:bounds[d + 1]]
+                  for d in (self._doc_rows.get(name) for name in docs) if d is not None]
+        rows = np.sort(np.concatenate(groups)) if groups else np.zeros(0, dtype=np.int64)
+        if pages is not None and len(rows):
+            # Keep chunks whose page span covers a routed page
+            keep = np.zeros(len(rows), dtype=bool)
+            for doc, page in pages:
+                d = self._doc_rows.get(doc)
+                if d is None:
+                    continue
+                keep |= (doc_col[rows] == d) & (page_col[rows] <= page) & (end_col[rows] >= page)
+            rows = rows[keep]
+        return rows
+
+    def freeze(self, directory, prefix):
+        """
+        Write all text to a file named by its content hash and memory-map it;
+        later appends go to the tail. Processes loading the same collection
+        map the same file and so share its pages.
+        """
+        data = bytes(self.base) + bytes(self.tail)
+        if not data:
+            return
+        digest = hashlib.blake2b(data, digest_size=8).hexdigest()
+        path = os.path.join(directory, f"{prefix}-{digest}.bin")
+
+        if not os.path.exists(path):
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+            # Older snapshots stay readable by processes that still map them
+            for name in os.listdir(directory):
+                if name.startswith(prefix + "-") and name.endswith(".bin") and name != os.path.basename(path):
+                    try:
+                        os.remove(os.path.join(directory, name))
+                    except OSError:
+                        pass
+
+        with open(path, "rb") as f:
+            self.base = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.tail = bytearray()
+
+# ---------------- QUANTIZED VECTORS ----------------
+
+def quantize(embeddings):
+    """
+    Symmetric per-vector int8 quantization of L2-normalized rows
+    Returns (codes int8 [n, dim], scales float32 [n]) with row ~= codes * scale
+    """
+    embs = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+    embs = embs / (np.linalg.norm(embs, axis=1, keepdims=True) + 1e-10)
+    scales = np.abs(embs).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.rint(embs / scales[:, None]).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+class QuantizedIndex:
+    """
+    int8 embeddings aligned with ChunkStore rows, scored by exact brute force
+    over the codes: int32 dot products times the two scales approximate
+    cosine similarity at a quarter of the float32 memory. With a directory,
+    codes are saved there as .npy files keyed by prefix (the collection) and
+    memory-mapped, so restarts and sibling workers don't rebuild them.
+    """
+    def __init__(self, directory=None, prefix=None):
+        self.directory = directory
+        self.prefix = prefix
+        self.codes = None
+        self.scales = np.zeros(0, dtype=np.float32)
+        self._pending = []         # (codes, scales) added since the last search
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.scales) + sum(len(s) for _, s in self._pending)
+
+    @property
+    def nbytes(self):
+        self._consolidate()
+        return (self.codes.nbytes if self.codes is not None else 0) + self.scales.nbytes
+
+    def add(self, embeddings):
+        """Append rows (in the same order as the chunk store)"""
+        if len(embeddings):
+            codes = quantize(embeddings)
+            with self._lock:
+                self._pending.append(codes)
+
+    def _consolidate(self):
+        with self._lock:
+            if self._pending:
+                parts = ([(self.codes, self.scales)] if self.codes is not None else []) + self._pending
+                self.codes = np.concatenate([c for c, _ in parts])
+                self.scales = np.concatenate([s for _, s in parts])
+                self._pending = []
+
+    def _snapshots(self):
+        """Saved snapshot paths (without the .keys.npy suffix), newest first"""
+        pattern = re.compile(re.escape(self.prefix) + r"-[0-9a-f]{16}\.keys\.npy")
+        try:
+            names = [name for name in os.listdir(self.directory) if pattern.fullmatch(name)]
+        except OSError:
+            return []
+        stems = [os.path.join(self.directory, name[:-len(".keys.npy")]) for name in names]
+        return sorted(stems, key=lambda stem: os.path.getmtime(stem + ".keys.npy"), reverse=True)
+
+    @staticmethod
+    def _open(stem):
+        return tuple(np.load(f"{stem}.{part}.npy", mmap_mode="r") for part in ("codes", "scales", "keys"))
+
+    def save(self, keys):
+        """
+        Write codes, scales and the chunk keys of their rows (ChunkStore.keys)
+        to files named by content hash and memory-map them. The keys file is
+        written last and marks a complete snapshot.
+        """
+        if self.directory is None:
+            return
+        self._consolidate()
+        codes, scales = self.codes, self.scales
+        if codes is None:
+            return
+        keys = np.asarray(keys[:len(scales)], dtype=np.int64)
+        digest = hashlib.blake2b(keys.tobytes() + np.ascontiguousarray(scales).tobytes(),
+                                 digest_size=8).hexdigest()
+        stem = os.path.join(self.directory, f"{self.prefix}-{digest}")
+
+        if not os.path.exists(stem + ".keys.npy"):
+            os.makedirs(self.directory, exist_ok=True)
+            for part, data in (("codes", codes), ("scales", scales), ("keys", keys)):
+                tmp = f"{stem}.{part}.{os.getpid()}.{threading.get_ident()}.tmp.npy"
+                np.save(tmp, data)
+                os.replace(tmp, f"{stem}.{part}.npy")
+            # Older snapshots stay readable by processes that still map them
+            for old in self._snapshots():
+                if old != stem:
+                    for part in ("keys", "codes", "scales"):
+                        try:
+                            os.remove(f"{old}.{part}.npy")
+                        except OSError:
+                            pass
+
+        try:
+            mapped_codes, mapped_scales, _ = self._open(stem)
+        except (OSError, ValueError):
+            return   # removed by a concurrent save; keep the in-memory copy
+        with self._lock:
+            if self.codes is codes:
+                self.codes, self.scales = mapped_codes, mapped_scales
+
+    def load(self, keys, fetch):
+        """
+        Codes for the chunks with the given keys, in row order, from the newest
+        saved snapshot (memory-mapped as is when it covers exactly these rows).
+        Rows it lacks are quantized from fetch(rows) -> float embeddings and a
+        new snapshot is saved; on first start that is every row.
+        """
+        keys = np.asarray(keys, dtype=np.int64)
+        if not len(keys):
+            return
+        saved = None
+        for stem in self._snapshots() if self.directory is not None else []:
+            try:
+                saved = self._open(stem)
+                break
+            except (OSError, ValueError):
+                continue
+
+        if saved is not None and np.array_equal(saved[2], keys):
+            with self._lock:
+                self.codes, self.scales, self._pending = saved[0], saved[1], []
+            return
+
+        missing = np.arange(len(keys))
+        codes = scales = None
+        if saved is not None and len(saved[2]):
+            saved_codes, saved_scales, saved_keys = saved
+            order = np.argsort(saved_keys, kind="stable")
+            pos = np.minimum(np.searchsorted(saved_keys[order], keys), len(order) - 1)
+            found = saved_keys[order[pos]] == keys
+            codes = np.zeros((len(keys), saved_codes.shape[1]), dtype=np.int8)
+            scales = np.ones(len(keys), dtype=np.float32)
+            codes[found] = saved_codes[order[pos[found]]]
+            scales[found] = saved_scales[order[pos[found]]]
+            missing = np.flatnonzero(~found)
+        if len(missing):
+            new_codes, new_scales = quantize(fetch(missing))
+            if codes is None:
+                codes, scales = new_codes, new_scales
+            else:
+                codes[missing], scales[missing] = new_codes, new_scales
+        with self._lock:
+            self.codes, self.scales, self._pending = codes, scales, []
+        self.save(keys)
+
+    def search(self, q_emb, k, rows=None):
+        """
+        Top k rows (optionally only among rows) by approximate cosine
+        Returns (rows, scores), best first
+        """
+        self._consolidate()
+        if self.codes is None or k <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        q_codes, q_scale = quantize(q_emb)
+        codes, scales = self.codes, self.scales
+        if rows is not None:
+            rows = rows[rows < len(scales)]
+            codes, scales = codes[rows], scales[rows]
+
+        # int8 x int8 accumulated in int32: exact, no float copy of the matrix
+        scores = np.einsum("ij,j->i", codes, q_codes[0], dtype=np.int32) * scales * q_scale[0]
+        k = min(k, len(scores))
+        if not k:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return (rows[top] if rows is not None else top), scores[top]
+
+# ---------------- CONTEXT ASSEMBLY ----------------
+
+def find_boilerplate(pages, edge_lines=2, min_ratio=0.5):
+    """
+    Find running headers/footers: lines repeated at the top or bottom of
+    most pages. Digits are wildcarded so "Page 3 of 10" matches every page.
+    Returns compiled patterns that match the boilerplate in cleaned text.
+    """
+    if len(pages) < 3:
+        return []
+
+    counts = Counter()
+    for text in pages:
+        lines = [clean_text(line) for line in text.splitlines() if line.strip()]
+        edges = lines[:edge_lines] + lines[-edge_lines:]
+        counts.update({re.sub(r"\d+", "#", line) for line in edges})
+
+    # Short keys ("more", "#") would strip ordinary words from the body
+    threshold = max(2, min_ratio * len(pages))
+    return [
+        re.compile(r"\b" + r"\d+".join(re.escape(part) for part in key.split("#")) + r"\b")
+        for key, n in counts.items()
+        if n >= threshold and len(key) >= 8 and re.search(r"[A-Za-z]", key)
+    ]
+
+def strip_boilerplate(text, patterns):
+    """Remove header/footer patterns from a chunk"""
+    for pattern in patterns:
+        text = pattern.sub(" ", text)
+    return clean_text(text)
+
+def merge_overlap(a, b, max_overlap=50):
+    """Join two adjacent chunks, dropping the words b repeats from the end of a"""
+    a_words, b_words = a.split(), b.split()
+    for n in range(min(max_overlap, len(a_words), len(b_words)), 0, -1):
+        if a_words[-n:] == b_words[:n]:
+            return " ".join(a_words + b_words[n:])
+    return a + " " + b
+
+def mmr_select(query_emb, embeddings, k, lambda_mult=MMR_LAMBDA):
+    """
+    Maximal marginal relevance: greedily pick k items that are relevant to
+    the query but dissimilar to the items already picked.
+    Returns indices into embeddings in selection order.
+    """
+    embs = np.asarray(embeddings, dtype=np.float32)
+    embs = embs / (np.linalg.norm(embs, axis=1, keepdims=True) + 1e-10)
+    q = np.asarray(query_emb, dtype=np.float32)
+    q = q / (np.linalg.norm(q) + 1e-10)
+
+    relevance = embs @ q
+    pairwise = embs @ embs.T
+
+    selected = []
+    candidates = list(range(len(embs)))
+    while candidates and len(selected) < k:
+        if selected:
+            redundancy = pairwise[np.ix_(candidates, selected)].max(axis=1)
+        else:
+            redundancy = np.zeros(len(candidates))
+        scores = lambda_mult * relevance[candidates] - (1 - lambda_mult) * redundancy
+        best = candidates[int(np.argmax(scores))]
+        selected.append(best)
+        candidates.remove(best)
+    return selected
+
+# ---------------- SEMANTIC CACHE ----------------
+
+class SemanticCache:
+    """
+    LRU cache keyed by query embedding. A lookup hits when a stored query
+    with the same params has cosine similarity >= threshold.
+    Tracks hits, misses and the compute time saved by hits.
+    """
+    def __init__(self, max_size=SEMANTIC_CACHE_SIZE, threshold=SEMANTIC_CACHE_THRESHOLD):
+        self.max_size = max_size
+        self.threshold = threshold
+        self.entries = OrderedDict()  # entry id -> (params, unit embedding, value, cost)
+        self.lock = threading.Lock()
+        self._next_id = 0
+        self.generation = 0  # bumped on clear so in-flight results are not stored
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0,
+                      "invalidations": 0, "saved_seconds": 0.0}
+
+    @staticmethod
+    def _unit(emb):
+        emb = np.asarray(emb, dtype=np.float32)
+        return emb / (np.linalg.norm(emb) + 1e-10)
+
+    def get(self, emb, params):
+        """Return the cached value for the closest matching query, or None"""
+        q = self._unit(emb)
+        with self.lock:
+            ids = [i for i, entry in self.entries.items() if entry[0] == params]
+            if ids:
+                sims = np.stack([self.entries[i][1] for i in ids]) @ q
+                best = int(np.argmax(sims))
+                if sims[best] >= self.threshold:
+                    entry_id = ids[best]
+                    self.entries.move_to_end(entry_id)
+                    self.stats["hits"] += 1
+                    self.stats["saved_seconds"] += self.entries[entry_id][3]
+                    return self.entries[entry_id][2]
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, emb, params, value, cost=0.0, generation=None):
+        """
+        Store value computed in cost seconds, evicting the least recently used.
+        Pass the generation read before computing to skip results made stale
+        by a clear() in the meantime.
+        """
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return
+            self.entries[self._next_id] = (params, self._unit(emb), value, cost)
+            self._next_id += 1
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def clear(self):
+        """Drop every entry (the corpus changed)"""
+        with self.lock:
+            self.entries.clear()
+            self.generation += 1
+            self.stats["invalidations"] += 1
+
+    def summary(self):
+        """Cache statistics for tuning size and threshold"""
+        with self.lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return dict(
+                self.stats,
+                size=len(self.entries),
+                max_size=self.max_size,
+                threshold=self.threshold,
+                hit_rate=self.stats["hits"] / lookups if lookups else 0.0
+            )
+
 # ---------------- EVALUATION METRICS ----------------
 
 def calculate_rouge_scores(reference, generated):
@@ -109,106 +867,728 @@ def evaluate_search_relevance(retrieved_docs, expected_doc_content):
         'relevance_score': max(similarities) if similarities else 0
     }
 
+# ---------------- SEARCH TRACE ----------------
+
+trace_log = logging.getLogger("rag.search")
+if SEARCH_TRACE_RATE and not trace_log.handlers:
+    handler = logging.FileHandler(SEARCH_TRACE_LOG) if SEARCH_TRACE_LOG else logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    trace_log.addHandler(handler)
+    trace_log.setLevel(logging.INFO)
+    trace_log.propagate = False
+
+class QueryTrace:
+    """
+    What one hybrid search did: per-stage timings, candidate counts, vector
+    and lexical hits with scores and ranks, and rows dropped when merging.
+    The engine only fills it in when one is passed, so untraced searches
+    pay nothing for it.
+    """
+    def __init__(self, query, top_k, use_cache=True):
+        self.query = query
+        self.top_k = top_k
+        self.use_cache = use_cache   # explain mode bypasses the semantic cache
+        self.cache = None
+        self.stages = {}
+        self._start = self._last = time.perf_counter()
+
+    def mark(self, stage, **info):
+        """Record a finished stage and the time since the previous mark"""
+        now = time.perf_counter()
+        self.stages[stage] = dict(info, ms=(now - self._last) * 1000)
+        self._last = now
+
+    def as_dict(self):
+        """JSON-ready trace; "results" shows each returned chunk's origin"""
+        vector = {h["row"]: h for h in self.stages.get("vector", {}).get("hits", [])}
+        lexical = {h["row"]: h for h in self.stages.get("lexical", {}).get("hits", [])}
+        results = []
+        for rank, kept in enumerate(self.stages.get("merge", {}).get("kept", []), 1):
+            v, lx = vector.get(kept["row"], {}), lexical.get(kept["row"], {})
+            results.append(dict(
+                kept, rank=rank,
+                vector_rank=v.get("rank"), vector_score=v.get("score"),
+                lexical_rank=lx.get("rank"), lexical_score=lx.get("score")
+            ))
+        return {
+            "query": self.query,
+            "top_k": self.top_k,
+            "cache": self.cache,
+            "total_ms": (self._last - self._start) * 1000,
+            "stages": self.stages,
+            "results": results
+        }
+
 # ---------------- ENGINE ----------------
 
 class SearchEngine:
-    def __init__(self):
+    def __init__(self, chroma_dir=CHROMA_DIR, embedder=None, collection=None, text_store=None):
 
-        self.embedder = SentenceTransformer("all-MiniLM-L6-v2")
-        self.client = chromadb.PersistentClient(path="./chroma_store")
+        self.chroma_dir = chroma_dir
+        self.follows_active = collection is None
+        self.client = chromadb.PersistentClient(path=chroma_dir)
+        self.collection = self.client.get_or_create_collection(
+            collection or active_collection(chroma_dir)
+        )
 
-        self.collection = self.client.get_or_create_collection("docs")
+        # Collections record their chunking and model: reindex.py sets them,
+        # and a new empty collection gets the current defaults. Older
+        # collections without them were built with the word-window chunker.
+        settings = self.collection.metadata or {}
+        if not settings and self.collection.count() == 0:
+            settings = {"chunk_size": CHUNK_SIZE, "chunk_overlap": CHUNK_OVERLAP,
+                        "chunker": CHUNKER, "embed_model": EMBED_MODEL}
+            self.collection.modify(metadata=settings)
+        self.chunk_size = settings.get("chunk_size", CHUNK_SIZE)
+        self.chunk_overlap = settings.get("chunk_overlap", CHUNK_OVERLAP)
+        self.chunker = settings.get("chunker", "words")
+        self.embedder = embedder or SentenceTransformer(settings.get("embed_model", EMBED_MODEL))
+        self.text_store = text_store or TextStore()
 
         self.tfidf = TfidfVectorizer(stop_words="english")
-        self.tfidf_docs = []
         self.tfidf_matrix = None
 
+        # Chunk texts and positions, shared by both retrievers by row
+        self.chunks = ChunkStore()
+        self._adopt_lock = threading.Lock()
+
+        # int8 copy of the chunk embeddings when vector search runs in-process
+        self.quantized = (QuantizedIndex(QUANT_INDEX_DIR, self.collection.name)
+                          if VECTOR_INDEX == "int8" else None)
+        self.rerank_k = QUANT_RERANK_K
+
+        # Document/page representatives for two-stage retrieval
+        self.doc_centroids, self.page_centroids = centroid_collections(
+            self.client, self.collection.name
+        )
+
+        # Header/footer patterns per document, used when building contexts
+        self.boilerplate = {}
+
+        self.cache = SemanticCache()
+
+        self.load_lexical()
+
+    def load_lexical(self, page_size=ADD_BATCH_SIZE):
+        """Rebuild the chunk store, TF-IDF index and boilerplate patterns from the collection"""
+        docs = {}
+        for offset in range(0, self.collection.count(), page_size):
+            stored = self.collection.get(include=["documents", "metadatas"],
+                                         limit=page_size, offset=offset)
+            for chunk_id, text, meta in zip(stored["ids"], stored["documents"], stored["metadatas"]):
+                self.chunks.append(chunk_id, text, *chunk_position(chunk_id, meta))
+                docs.setdefault((meta or {}).get("doc"), (meta or {}).get("doc_hash"))
+        if self.quantized is not None:
+            self.quantized.load(self.chunks.keys, self.float_embeddings)
+
+        if CHUNK_STORE_DIR and len(self.chunks):
+            os.makedirs(CHUNK_STORE_DIR, exist_ok=True)
+            self.chunks.freeze(CHUNK_STORE_DIR, self.collection.name)
+        self.refit_lexical()
+
+        if ROUTE_DOCS and self.doc_centroids.count() == 0 and len(self.chunks):
+            self.build_centroids(page_size)
+
+        for name, doc_hash in docs.items():
+            if doc_hash and self.text_store.has(doc_hash):
+                self.boilerplate[name] = find_boilerplate(self.text_store.get(doc_hash)["pages"])
+
+    def float_embeddings(self, rows, page_size=ADD_BATCH_SIZE):
+        """Float embeddings of chunk store rows, read from Chroma"""
+        embs = []
+        for start in range(0, len(rows), page_size):
+            ids = [self.chunks.chunk_id(row) for row in rows[start:start + page_size]]
+            stored = self.collection.get(ids=ids, include=["embeddings"])
+            by_id = dict(zip(stored["ids"], stored["embeddings"]))
+            embs.extend(by_id[chunk_id] for chunk_id in ids)
+        return np.asarray(embs, dtype=np.float32)
+
+    def build_centroids(self, page_size=ADD_BATCH_SIZE):
+        """Backfill routing centroids for a collection indexed before they existed"""
+        embeddings, metas = [], []
+        for offset in range(0, self.collection.count(), page_size):
+            stored = self.collection.get(include=["embeddings", "metadatas"],
+                                         limit=page_size, offset=offset)
+            embeddings.extend(stored["embeddings"])
+            metas.extend(stored["metadatas"])
+        add_centroids(self.doc_centroids, self.page_centroids, embeddings, metas)
+
+    def refit_lexical(self):
+        """Fit TF-IDF over every stored chunk"""
+        if len(self.chunks):
+            self.tfidf_matrix = self.tfidf.fit_transform(self.chunks.iter_texts())
+
     def ingest_pdf(self, path, name):
-        """Ingest PDF, chunk it, and store in vector database"""
-        pdf = fitz.open(path)
-        texts = []
-
-        for page in pdf:
-            cleaned = clean_text(page.get_text())
-            chunks = chunk_text(cleaned)
-
-            for i, chunk in enumerate(chunks):
-                emb = self.embedder.encode(chunk).tolist()
-
-                self.collection.add(
-                    documents=[chunk],
-                    embeddings=[emb],
-                    metadatas=[{"doc": name, "page": page.number + 1}],
-                    ids=[f"{name}_{page.number}_{i}"]
-                )
-                texts.append(chunk)
+        """Ingest PDF, keep its extracted text, chunk it, and store in vector database"""
+        doc_hash = file_hash(path)
+        with fitz.open(path) as pdf:
+            pages = [page.get_text() for page in pdf]
+
+        self.text_store.put(doc_hash, name, pages)
+        self.ingest_pages(name, doc_hash, pages)
+
+    def ingest_pages(self, name, doc_hash, pages):
+        """Chunk and index extracted page texts"""
+        ids, texts, metas = chunk_document(name, doc_hash, pages, self.chunk_size,
+                                           self.chunk_overlap, self.chunker)
+        if texts:
+            embeddings = self.embedder.encode(texts)
+            add_chunks(self.collection, ids, texts, embeddings, metas)
+            add_centroids(self.doc_centroids, self.page_centroids, embeddings, metas)
+
+        # A concurrent search may already have adopted some of these ids. Chunk
+        # rows go in before their int8 codes, so a search never scores a row
+        # the chunk store doesn't have yet.
+        with self._adopt_lock:
+            present = [self.chunks.row_of(chunk_id) is not None for chunk_id in ids]
+            added = [i for i, skip in enumerate(present) if not skip]
+            for i in added:
+                self.chunks.append(ids[i], texts[i], *chunk_position(ids[i], metas[i]))
+            if self.quantized is not None and added:
+                self.quantized.add(np.asarray(embeddings)[added])
+        if self.quantized is not None:
+            self.quantized.save(self.chunks.keys)
+        self.boilerplate[name] = find_boilerplate(pages)
+        self.refit_lexical()
+
+        # Cached answers may miss the new document
+        self.cache.clear()
+
+    def route(self, q_emb, route_docs=ROUTE_DOCS, route_pages=ROUTE_PAGES):
+        """
+        First stage of hierarchical retrieval: the documents (and, if
+        route_pages, the (doc, page) pairs) whose centroids best match the query.
+        Returns (docs, pages) or (None, None) when flat search should be used.
+        """
+        if not route_docs or route_docs >= self.doc_centroids.count():
+            return None, None
+
+        q = [np.asarray(q_emb).tolist()]
+        hits = self.doc_centroids.query(query_embeddings=q, n_results=route_docs,
+                                        include=["metadatas"])
+        docs = [meta["doc"] for meta in hits["metadatas"][0]]
+        if not route_pages:
+            return docs, None
+
+        hits = self.page_centroids.query(query_embeddings=q, n_results=route_pages,
+                                         where={"doc": {"$in": docs}}, include=["metadatas"])
+        return docs, [(meta["doc"], meta["page"]) for meta in hits["metadatas"][0]]
+
+    @staticmethod
+    def _where(docs, pages):
+        """Chroma filter restricting chunk search to the routed docs/pages"""
+        if pages is None:
+            return {"doc": {"$in": docs}}
+        # A chunk covers pages page..page_end; chunks without page_end are single-page
+        clauses = [
+            {"$and": [{"doc": doc}, {"$or": [
+                {"page": page},
+                {"$and": [{"page": {"$lte": page}}, {"page_end": {"$gte": page}}]}
+            ]}]}
+            for doc, page in pages
+        ]
+        return clauses[0] if len(clauses) == 1 else {"$or": clauses}
+
+    def vector_rows(self, q_emb, k, docs=None, pages=None, trace=None):
+        """Rows of the k nearest chunks by embedding, within docs/pages if routed"""
+        if self.quantized is None:
+            vec = self.collection.query(
+                query_embeddings=[np.asarray(q_emb).tolist()],
+                n_results=k,
+                where=self._where(docs, pages) if docs is not None else None,
+                include=["distances"]
+            )
+            ids = vec["ids"][0] if vec["ids"] else []
+            rows = [self.chunks.row_of(chunk_id) for chunk_id in ids]
+            if None in rows:
+                # Chunks another worker process added to the shared collection
+                self.adopt([chunk_id for chunk_id, row in zip(ids, rows) if row is None])
+                rows = [self.chunks.row_of(chunk_id) for chunk_id in ids]
+            if trace is not None:
+                # Chunks the query could match; HNSW visits only part of them
+                eligible = (len(self.chunks.rows_for(docs, pages)) if docs is not None
+                            else self.collection.count())
+                trace.mark("vector", backend="chroma", metric="l2_distance", candidates=eligible,
+                           hits=self._hits(rows, vec["distances"][0] if rows else []))
+            return rows
+
+        rows = self.chunks.rows_for(docs, pages) if docs is not None else None
+        candidates, scores = self.quantized.search(q_emb, max(k, self.rerank_k), rows)
+        candidates = candidates.tolist()
+        if self.rerank_k and len(candidates) > 1:
+            candidates, scores = self.rerank(q_emb, candidates)
+        if trace is not None:
+            trace.mark("vector", backend="int8", metric="cosine", reranked=bool(self.rerank_k),
+                       candidates=len(rows) if rows is not None else len(self.quantized),
+                       hits=self._hits(candidates[:k], scores[:k]))
+        return candidates[:k]
 
-        self.tfidf_docs.extend(texts)
-        if self.tfidf_docs:
-            self.tfidf_matrix = self.tfidf.fit_transform(self.tfidf_docs)
+    def adopt(self, ids):
+        """
+        Append chunks written to the collection by another process (e.g. an
+        upload served by a different gunicorn worker) to this chunk store.
+        They are searchable by vector at once and by TF-IDF after the next refit.
+        """
+        include = ["documents", "metadatas"]
+        if self.quantized is not None:
+            include.append("embeddings")
+        with self._adopt_lock:
+            ids = [chunk_id for chunk_id in ids if self.chunks.row_of(chunk_id) is None]
+            if not ids:
+                return
+            stored = self.collection.get(ids=ids, include=include)
+            for chunk_id, text, meta in zip(stored["ids"], stored["documents"], stored["metadatas"]):
+                self.chunks.append(chunk_id, text, *chunk_position(chunk_id, meta))
+            if self.quantized is not None:
+                self.quantized.add(stored["embeddings"])
 
-    def search(self, query, top_k=5):
+    def rerank(self, q_emb, rows):
+        """
+        Re-order rows by exact cosine similarity of their float embeddings
+        (read from Chroma, which loads its float index into this process)
+        Returns (rows, scores), best first
+        """
+        ids = [self.chunks.chunk_id(row) for row in rows]
+        stored = self.collection.get(ids=ids, include=["embeddings"])
+        by_id = dict(zip(stored["ids"], stored["embeddings"]))
+        rows = [row for row, chunk_id in zip(rows, ids) if chunk_id in by_id]
+        if not rows:
+            return [], np.zeros(0, dtype=np.float32)
+        embs = np.asarray([by_id[self.chunks.chunk_id(row)] for row in rows], dtype=np.float32)
+        embs = embs / (np.linalg.norm(embs, axis=1, keepdims=True) + 1e-10)
+        q = np.asarray(q_emb, dtype=np.float32)
+        scores = embs @ (q / (np.linalg.norm(q) + 1e-10))
+        order = np.argsort(-scores, kind="stable")
+        return [rows[i] for i in order], scores[order]
+
+    def _hits(self, rows, scores):
+        """Trace entries for ranked retriever output"""
+        return [{"row": row, "id": self.chunks.chunk_id(row), "rank": rank, "score": float(score)}
+                for rank, (row, score) in enumerate(zip(rows, scores), 1) if row is not None]
+
+    def retrieve(self, query, top_k=5, q_emb=None, route_docs=ROUTE_DOCS, route_pages=ROUTE_PAGES,
+                 trace=None):
         """
         Hybrid search using both vector embeddings and TF-IDF
-        Returns top_k most relevant chunks
+        Returns top_k chunk records: {"row", "id", "text", "doc", "page", "page_end", "chunk"}
+        Pass a QueryTrace to record what each stage did.
         """
-        q_emb = self.embedder.encode(query).tolist()
-        
-        # Vector search
-        vec = self.collection.query(
-            query_embeddings=[q_emb],
-            n_results=top_k
-        )
+        if q_emb is None:
+            q_emb = self.embedder.encode(query)
 
-        results = vec["documents"][0] if vec["documents"] else []
+        docs, pages = self.route(q_emb, route_docs, route_pages)
+        routed = docs is not None
+        if trace is not None:
+            trace.mark("route", routed=routed, docs=docs, pages=pages)
+        if routed and pages == []:
+            return []
+        
+        # Vector search (rows only; text comes from the chunk store)
+        rows = self.vector_rows(q_emb, top_k, docs, pages, trace)
         
         # TF-IDF search (if we have documents)
-        if self.tfidf_matrix is not None and len(self.tfidf_docs) > 0:
+        if self.tfidf_matrix is not None and len(self.chunks) > 0:
             q_tfidf = self.tfidf.transform([query])
-            tfidf_scores = np.dot(self.tfidf_matrix, q_tfidf.T).toarray().ravel()
-            tfidf_idx = tfidf_scores.argsort()[-top_k:][::-1]
+            if routed:
+                # Score only the routed chunks
+                candidates = self.chunks.rows_for(docs, pages)
+                candidates = candidates[candidates < self.tfidf_matrix.shape[0]]
+                tfidf_scores = np.dot(self.tfidf_matrix[candidates], q_tfidf.T).toarray().ravel()
+                top = tfidf_scores.argsort()[-top_k:][::-1]
+                tfidf_idx = candidates[top]
+            else:
+                tfidf_scores = np.dot(self.tfidf_matrix, q_tfidf.T).toarray().ravel()
+                top = tfidf_idx = tfidf_scores.argsort()[-top_k:][::-1]
             
             # Add TF-IDF results
-            results += [self.tfidf_docs[i] for i in tfidf_idx if i < len(self.tfidf_docs)]
+            rows += [int(i) for i in tfidf_idx if i < len(self.chunks)]
+            if trace is not None:
+                trace.mark("lexical", candidates=len(tfidf_scores),
+                           hits=self._hits([int(i) for i in tfidf_idx], tfidf_scores[top]))
+
+        # Remove duplicates while preserving order, decoding only what is returned
+        results, seen, dropped = [], set(), []
+        unique = list(dict.fromkeys(r for r in rows if r is not None))
+        for row in unique:
+            if len(results) == top_k:
+                if trace is None:
+                    break
+                dropped.append({"row": row, "id": self.chunks.chunk_id(row), "reason": "top_k"})
+                continue
+            record = self.chunks.record(row)
+            if record["text"] not in seen:
+                seen.add(record["text"])
+                results.append(record)
+            elif trace is not None:
+                dropped.append({"row": row, "id": record["id"], "reason": "duplicate_text"})
+
+        if trace is not None:
+            trace.mark("merge", candidates=len(rows), duplicate_rows=len(rows) - len(unique),
+                       dropped=dropped,
+                       kept=[{k: r[k] for k in ("row", "id", "doc", "page")} for r in results])
+        return results
+
+    def search(self, query, top_k=5, trace=None):
+        """
+        Hybrid search using both vector embeddings and TF-IDF
+        Returns top_k most relevant chunks
+        A fraction SEARCH_TRACE_RATE of untraced searches is traced and logged.
+        """
+        sampled = None
+        if trace is None and SEARCH_TRACE_RATE and random.random() < SEARCH_TRACE_RATE:
+            trace = sampled = QueryTrace(query, top_k)
 
-        # Remove duplicates while preserving order
-        return list(dict.fromkeys(results))[:top_k]
+        q_emb = self.embedder.encode(query)
+        if trace is not None:
+            trace.mark("embed")
+        cached = None
+        if trace is None or trace.use_cache:
+            cached = self.cache.get(q_emb, ("search", top_k))
+        if trace is not None:
+            trace.cache = "bypassed" if not trace.use_cache else ("hit" if cached is not None else "miss")
+
+        if cached is None:
+            generation = self.cache.generation
+            start = time.perf_counter()
+            cached = [record["text"] for record in self.retrieve(query, top_k, q_emb=q_emb, trace=trace)]
+            self.cache.put(q_emb, ("search", top_k), cached,
+                           time.perf_counter() - start, generation)
+
+        if sampled is not None:
+            trace_log.info(json.dumps(dict(sampled.as_dict(), event="search_trace",
+                                           timestamp=time.strftime("%Y-%m-%dT%H:%M:%S"))))
+        return list(cached)
+
+    def get_context(self, query, top_k=CONTEXT_TOP_K, fetch_k=CONTEXT_FETCH_K,
+                    lambda_mult=MMR_LAMBDA, q_emb=None):
+        """
+        Build a compact prompt context for query: MMR over the hybrid
+        candidates, adjacent overlapping chunks merged, headers/footers stripped
+        Returns a list of passages in document order
+        """
+        if q_emb is None:
+            q_emb = self.embedder.encode(query)
+        candidates = self.retrieve(query, fetch_k, q_emb=q_emb)
+        if not candidates:
+            return []
+
+        stored = self.collection.get(
+            ids=[c["id"] for c in candidates],
+            include=["embeddings"]
+        )
+        by_id = dict(zip(stored["ids"], stored["embeddings"]))
+        candidates = [c for c in candidates if c["id"] in by_id]
+        if not candidates:
+            return []
+
+        picked = mmr_select(q_emb, [by_id[c["id"]] for c in candidates], top_k, lambda_mult)
+        picked = sorted((candidates[i] for i in picked),
+                        key=lambda c: (c["doc"], c["page"], c["chunk"]))
+
+        # Merge consecutive chunks into one passage. Sentence chunks are
+        # numbered through the document and may continue onto later pages;
+        # word-window chunks (page_end == page) only merge within a page.
+        merged = []
+        for record in picked:
+            prev = merged[-1] if merged else None
+            if (prev and prev["doc"] == record["doc"] and record["page"] <= prev["page_end"]
+                    and prev["last_chunk"] + 1 == record["chunk"]):
+                prev["text"] = merge_overlap(prev["text"], record["text"])
+                prev["last_chunk"] = record["chunk"]
+                prev["page_end"] = max(prev["page_end"], record["page_end"])
+            else:
+                merged.append(dict(record, last_chunk=record["chunk"]))
+
+        passages = []
+        for record in merged:
+            text = strip_boilerplate(record["text"], self.boilerplate.get(record["doc"], []))
+            if text:
+                passages.append(text)
+        return passages
 
 # engine = SearchEngine()
 engine = None
+_engine_lock = threading.Lock()
+_active_checked = 0.0
+
+def engine_outdated(current):
+    """
+    True if another collection has been activated since current was loaded.
+    Checked at most every ACTIVE_CHECK_INTERVAL seconds per process.
+    """
+    global _active_checked
+    now = time.monotonic()
+    if not current.follows_active or now - _active_checked < ACTIVE_CHECK_INTERVAL:
+        return False
+    _active_checked = now
+    return active_collection(current.chroma_dir) != current.collection.name
 
 def get_engine():
+    """The process's engine, reloaded when reindex.py activates a new collection"""
     global engine
-    if engine is None:
-        engine = SearchEngine()
+    if engine is None or engine_outdated(engine):
+        with _engine_lock:
+            if engine is None:
+                engine = SearchEngine()
+            elif engine.follows_active and active_collection(engine.chroma_dir) != engine.collection.name:
+                engine = SearchEngine(chroma_dir=engine.chroma_dir, text_store=engine.text_store)
     return engine
+
+def admin_authorized(token):
+    """True if token matches ADMIN_TOKEN; admin routes are disabled without one"""
+    return bool(ADMIN_TOKEN and token and hmac.compare_digest(token, ADMIN_TOKEN))
 # ---------------- GEMINI ----------------
 
-def summarize(text, length):
-    """Generate summary using Google Gemini"""
+# Provider errors worth retrying (rate limits and transient server errors)
+RETRYABLE_LLM_ERRORS = (
+    google_exceptions.ResourceExhausted,
+    google_exceptions.TooManyRequests,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.InternalServerError,
+    google_exceptions.DeadlineExceeded,
+)
+
+class LLMBusyError(Exception):
+    """The LLM is saturated or rate limited; the API answers 503"""
+
+class BaseLLMScheduler:
+    """
+    Admission bookkeeping, counters and retry delays shared by LLMScheduler
+    (threads) and asgi_app.AsyncLLMScheduler (asyncio). Subclasses serialize
+    calls to these methods (a lock, or the event loop).
+    """
+    def __init__(self, max_concurrency, max_queue, queue_timeout, max_retries,
+                 backoff_base, backoff_max):
+        self.max_concurrency = max_concurrency
+        self.capacity = max_concurrency + max_queue
+        self.queue_timeout = queue_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.inflight = {}   # prompt -> future shared by identical callers
+        self.admitted = 0    # running + waiting leader calls
+        self.stats = {"calls": 0, "coalesced": 0, "retries": 0, "rejected": 0, "failed": 0}
+
+    def _admit(self, key, new_future):
+        """
+        Join the in-flight call for key, or start one with new_future()
+        Returns (future, is_leader); raises LLMBusyError when the queue is full
+        """
+        future = self.inflight.get(key)
+        if future is not None:
+            self.stats["coalesced"] += 1
+            return future, False
+        if self.admitted >= self.capacity:
+            self.stats["rejected"] += 1
+            raise LLMBusyError("Summarization queue is full, please retry shortly")
+        self.stats["calls"] += 1
+        self.admitted += 1
+        self.inflight[key] = future = new_future()
+        return future, True
+
+    def _release(self, key):
+        self.inflight.pop(key, None)
+        self.admitted -= 1
+
+    def _retry_delay(self, attempt, error):
+        """
+        Count a retryable error and return the backoff before the next attempt
+        (full jitter, doubling per attempt); raises LLMBusyError after the last
+        """
+        if attempt == self.max_retries:
+            self.stats["failed"] += 1
+            raise LLMBusyError(f"LLM unavailable after {attempt + 1} attempts: {error}") from error
+        self.stats["retries"] += 1
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def summary(self):
+        return dict(self.stats, inflight=len(self.inflight), admitted=self.admitted)
+
+class LLMScheduler(BaseLLMScheduler):
+    """
+    Admission control for LLM calls: a global concurrency limit with a
+    bounded wait queue, single-flight coalescing of identical in-flight
+    prompts, and jittered exponential backoff on retryable errors
+    """
+    def __init__(self, max_concurrency=LLM_MAX_CONCURRENCY, max_queue=LLM_MAX_QUEUE,
+                 queue_timeout=LLM_QUEUE_TIMEOUT, max_retries=LLM_MAX_RETRIES,
+                 backoff_base=LLM_BACKOFF_BASE, backoff_max=LLM_BACKOFF_MAX):
+        super().__init__(max_concurrency, max_queue, queue_timeout, max_retries,
+                         backoff_base, backoff_max)
+        self.semaphore = threading.BoundedSemaphore(max_concurrency)
+        self.lock = threading.Lock()
+
+    def call(self, key, fn):
+        """Run fn() for key, sharing the result with concurrent calls for the same key"""
+        with self.lock:
+            future, leader = self._admit(key, Future)
+        if not leader:
+            return future.result()
+
+        try:
+            if not self.semaphore.acquire(timeout=self.queue_timeout):
+                with self.lock:
+                    self.stats["rejected"] += 1
+                raise LLMBusyError("Timed out waiting for a summarization slot")
+            try:
+                result = self._with_retries(fn)
+            finally:
+                self.semaphore.release()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                self._release(key)
+
+    def _with_retries(self, fn):
+        for attempt in range(self.max_retries + 1):
+            try:
+                return fn()
+            except RETRYABLE_LLM_ERRORS as e:
+                with self.lock:
+                    delay = self._retry_delay(attempt, e)
+                time.sleep(delay)
+
+    def summary(self):
+        with self.lock:
+            return super().summary()
+
+llm = LLMScheduler()
+
+def generate(prompt):
+    """Single Gemini call"""
+    model = genai.GenerativeModel("models/gemini-2.5-flash")
+    return model.generate_content(prompt).text
+
+def build_prompt(text, length):
+    """Summarization prompt for text at the requested length"""
     size = {"short": "100", "medium": "200", "long": "400"}[length]
 
-    prompt = f"""
+    return f"""
 Summarize the following content in approximately {size} words.
 Use only the provided text. Be concise and capture the main points.
 
 {text}
 """
-    model = genai.GenerativeModel("models/gemini-2.5-flash")
-    return model.generate_content(prompt).text
+
+def summarize(text, length):
+    """Generate summary using Google Gemini"""
+    prompt = build_prompt(text, length)
+
+    # Identical prompts already in flight share one call
+    return llm.call(prompt, lambda: generate(prompt))
 
 # ---------------- APP ----------------
 
 app = Flask(__name__)
 CORS(app)
 
+# ---------------- PROFILING ----------------
+
+def profile_authorized():
+    """True if the request carries the profiling token"""
+    token = request.headers.get("X-Profile")
+    return bool(PROFILE_TOKEN and token and hmac.compare_digest(token, PROFILE_TOKEN))
+
+def finish_profile():
+    """Stop the request's profiler and save it; returns the profile name"""
+    profiler = g.pop("profiler", None)
+    if profiler is None:
+        return None
+    profiler.disable()
+
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}_{request.endpoint}_{time.perf_counter_ns()}.prof"
+    profiler.dump_stats(os.path.join(PROFILE_DIR, name))
+    prune_profiles()
+    return name
+
+def prune_profiles(max_files=PROFILE_MAX_FILES):
+    """Delete the oldest saved profiles beyond max_files"""
+    paths = [os.path.join(PROFILE_DIR, n) for n in os.listdir(PROFILE_DIR) if n.endswith(".prof")]
+    if len(paths) <= max_files:
+        return
+    paths.sort(key=lambda p: os.stat(p).st_mtime if os.path.exists(p) else 0)
+    for path in paths[:len(paths) - max_files]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass  # already removed by a concurrent request
+
+@app.before_request
+def start_profile():
+    """Profile this request if enabled globally or by an authorized header"""
+    if not (PROFILE_ALL_REQUESTS or PROFILE_TOKEN):
+        return
+    if request.endpoint in ("list_profiles", "get_profile"):
+        return
+    if PROFILE_ALL_REQUESTS or profile_authorized():
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is active on this interpreter; skip this one
+            return
+        g.profiler = profiler
+
+@app.after_request
+def save_profile(response):
+    name = finish_profile()
+    if name:
+        response.headers["X-Profile-Id"] = name
+    return response
+
+@app.teardown_request
+def abort_profile(exc):
+    # after_request is skipped on unhandled errors; don't leave the profiler on
+    finish_profile()
+
+@app.route("/profiles", methods=["GET"])
+def list_profiles():
+    """List saved request profiles (requires the profiling token)"""
+    if not profile_authorized():
+        return jsonify({"error": "Profiling token required"}), 403
+    names = sorted(os.listdir(PROFILE_DIR), reverse=True) if os.path.isdir(PROFILE_DIR) else []
+    return jsonify({"status": "success", "profiles": names})
+
+@app.route("/profiles/<name>", methods=["GET"])
+def get_profile(name):
+    """
+    Download a saved profile (.prof, open with pstats or snakeviz)
+    ?format=text returns the top functions by cumulative time instead
+    """
+    if not profile_authorized():
+        return jsonify({"error": "Profiling token required"}), 403
+    if request.args.get("format") != "text":
+        return send_from_directory(os.path.abspath(PROFILE_DIR), name)
+
+    path = os.path.join(PROFILE_DIR, os.path.basename(name))
+    if not os.path.isfile(path):
+        return jsonify({"error": "Profile not found"}), 404
+    out = io.StringIO()
+    pstats.Stats(path, stream=out).sort_stats("cumulative").print_stats(50)
+    return out.getvalue(), 200, {"Content-Type": "text/plain; charset=utf-8"}
+
 @app.route("/", methods=["GET"])
 def home():
     """Health check endpoint"""
     return jsonify({
         "status": "online",
         "message": "RAG Backend API is running",
-        "endpoints": ["/upload", "/search", "/summarize", "/evaluate"]
+        "endpoints": ["/upload", "/search", "/summarize", "/evaluate", "/cache", "/reload"]
+    })
+
+@app.route("/cache", methods=["GET"])
+def cache_stats():
+    """Semantic cache hit rate and time saved, plus LLM scheduler counters"""
+    engine = get_engine()
+    return jsonify({
+        "status": "success",
+        "cache": engine.cache.summary(),
+        "llm": llm.summary()
     })
 
 @app.route("/upload", methods=["POST"])
@@ -237,6 +1617,23 @@ def upload():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route("/reload", methods=["POST"])
+def reload_engine():
+    """Switch this worker to the active collection now (requires X-Admin-Token)"""
+    global engine
+    if not admin_authorized(request.headers.get("X-Admin-Token")):
+        return jsonify({"error": "Admin token required"}), 403
+    try:
+        # In-flight requests keep the old engine until they finish
+        engine = SearchEngine()
+        return jsonify({
+            "status": "success",
+            "collection": engine.collection.name,
+            "chunks": engine.collection.count()
+        })
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 @app.route("/search", methods=["POST"])
 def search():
     """Search for relevant documents"""
@@ -245,14 +1642,22 @@ def search():
         if not data or 'query' not in data:
             return jsonify({"error": "Query parameter required"}), 400
         
+        # explain=true (body or query string) returns the search trace
+        explain = str(data.get("explain", request.args.get("explain", ""))).lower() in ("1", "true", "yes")
+        top_k = data.get("top_k", 5)
+        trace = QueryTrace(data["query"], top_k, use_cache=False) if explain else None
+
         engine = get_engine()
-        results = engine.search(data["query"], data.get("top_k", 5))
-        return jsonify({
+        results = engine.search(data["query"], top_k, trace=trace)
+        response = {
             "status": "success",
             "query": data["query"],
             "results": results,
             "count": len(results)
-        })
+        }
+        if trace is not None:
+            response["explain"] = trace.as_dict()
+        return jsonify(response)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -264,27 +1669,42 @@ def summarize_api():
         if not data or 'query' not in data:
             return jsonify({"error": "Query parameter required"}), 400
         
-        # Search for relevant documents
+        # Near-duplicate queries reuse a cached summary
         engine = get_engine()
-        docs = engine.search(data["query"])
+        length = data.get("length", "medium")
+        q_emb = engine.embedder.encode(data["query"])
+        cached = engine.cache.get(q_emb, ("summarize", length))
 
-        
-        if not docs:
-            return jsonify({
-                "error": "No relevant documents found",
-                "summary": "No documents available to summarize."
-            }), 404
-        
-        combined = "\n\n".join(docs)
-        summary = summarize(combined, data.get("length", "medium"))
+        if cached is not None:
+            summary, source_chunks = cached
+        else:
+            generation = engine.cache.generation
+            start = time.perf_counter()
+
+            # Search for relevant documents and assemble a de-duplicated context
+            docs = engine.get_context(data["query"], q_emb=q_emb)
+
+            if not docs:
+                return jsonify({
+                    "error": "No relevant documents found",
+                    "summary": "No documents available to summarize."
+                }), 404
+
+            combined = "\n\n".join(docs)
+            summary = summarize(combined, length)
+            source_chunks = len(docs)
+            engine.cache.put(q_emb, ("summarize", length), (summary, source_chunks),
+                             time.perf_counter() - start, generation)
         
         return jsonify({
             "status": "success",
             "query": data["query"],
             "summary": summary,
-            "source_chunks": len(docs),
+            "source_chunks": source_chunks,
             "length": data.get("length", "medium")
         })
+    except LLMBusyError as e:
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -309,7 +1729,7 @@ def evaluate():
         
         # Perform search
         engine = get_engine()
-        retrieved_docs = engine.search(data["query"])
+        retrieved_docs = engine.get_context(data["query"])
 
         
         # Generate summary
@@ -350,6 +1770,8 @@ def evaluate():
             "evaluation": evaluation_results
         })
         
+    except LLMBusyError as e:
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -384,7 +1806,7 @@ def run_test_suite():
             
             # Search
             engine = get_engine()
-            retrieved_docs = engine.search(query)
+            retrieved_docs = engine.get_context(query)
 
             
             # Summarize
@@ -422,6 +1844,8 @@ def run_test_suite():
             }
         })
         
+    except LLMBusyError as e:
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
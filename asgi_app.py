@@ -0,0 +1,371 @@
+"""
+Async (ASGI) serving mode for the RAG API
+
+Same routes and JSON as the Flask app in GenAI_rag.py, but Gemini calls are
+awaited instead of holding a thread, and CPU-bound work (embedding, search,
+scoring, ingest) runs on a bounded thread pool. Calls waiting for an LLM
+slot cost a coroutine rather than a thread, so one process can queue
+hundreds of /summarize requests (ASGI_LLM_MAX_QUEUE) instead of rejecting
+them.
+
+    uvicorn asgi_app:app --host 0.0.0.0 --port 8000
+    python asgi_app.py
+"""
+import os
+import asyncio
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import uvicorn
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+from GenAI_rag import (
+    genai, UPLOAD_DIR, SearchEngine, BaseLLMScheduler, LLMBusyError, RETRYABLE_LLM_ERRORS,
+    LLM_MAX_CONCURRENCY, LLM_QUEUE_TIMEOUT, LLM_MAX_RETRIES,
+    LLM_BACKOFF_BASE, LLM_BACKOFF_MAX, QueryTrace, build_prompt,
+    get_engine, engine_outdated, admin_authorized,
+    calculate_rouge_scores, calculate_bleu_score, evaluate_search_relevance
+)
+import GenAI_rag
+
+# Threads for embedding, scoring and ingest; requests beyond this wait their turn
+CPU_WORKERS = int(os.getenv("ASGI_CPU_WORKERS", min(8, os.cpu_count() or 4)))
+
+# Calls waiting for an LLM slot; a waiting call costs a coroutine, not a
+# thread, so this can be far larger than the Flask app's LLM_MAX_QUEUE
+ASGI_LLM_MAX_QUEUE = int(os.getenv("ASGI_LLM_MAX_QUEUE", 512))
+
+executor = ThreadPoolExecutor(max_workers=CPU_WORKERS, thread_name_prefix="rag-cpu")
+
+async def run_cpu(fn, *args, **kwargs):
+    """Run a blocking function on the bounded CPU pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(fn, *args, **kwargs))
+
+# ---------------- LLM ----------------
+
+class AsyncLLMScheduler(BaseLLMScheduler):
+    """
+    asyncio counterpart of GenAI_rag.LLMScheduler: concurrency limit with a
+    bounded wait queue, single-flight coalescing of identical prompts, and
+    jittered exponential backoff, all without blocking a thread
+    """
+    def __init__(self, max_concurrency=LLM_MAX_CONCURRENCY, max_queue=ASGI_LLM_MAX_QUEUE,
+                 queue_timeout=LLM_QUEUE_TIMEOUT, max_retries=LLM_MAX_RETRIES,
+                 backoff_base=LLM_BACKOFF_BASE, backoff_max=LLM_BACKOFF_MAX):
+        super().__init__(max_concurrency, max_queue, queue_timeout, max_retries,
+                         backoff_base, backoff_max)
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def call(self, key, fn):
+        """Await fn() for key, sharing the result with concurrent calls for the same key"""
+        future, leader = self._admit(key, asyncio.get_running_loop().create_future)
+        if not leader:
+            return await asyncio.shield(future)
+        try:
+            try:
+                await asyncio.wait_for(self.semaphore.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.stats["rejected"] += 1
+                raise LLMBusyError("Timed out waiting for a summarization slot")
+            try:
+                result = await self._with_retries(fn)
+            finally:
+                self.semaphore.release()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+                future.exception()  # mark retrieved when nobody else was waiting
+            raise
+        finally:
+            self._release(key)
+
+    async def _with_retries(self, fn):
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await fn()
+            except RETRYABLE_LLM_ERRORS as e:
+                await asyncio.sleep(self._retry_delay(attempt, e))
+
+llm = AsyncLLMScheduler()
+
+async def generate_async(prompt):
+    """Single Gemini call, awaited"""
+    model = genai.GenerativeModel("models/gemini-2.5-flash")
+    response = await model.generate_content_async(prompt)
+    return response.text
+
+async def summarize_async(text, length):
+    """Generate summary using Google Gemini without holding a thread"""
+    prompt = build_prompt(text, length)
+    return await llm.call(prompt, lambda: generate_async(prompt))
+
+# ---------------- ROUTES ----------------
+
+async def read_json(request):
+    """Request body as JSON, or None if missing or invalid"""
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+async def engine_async():
+    """Shared engine; the first load and collection switches run on the CPU pool"""
+    if GenAI_rag.engine is None or engine_outdated(GenAI_rag.engine):
+        await run_cpu(get_engine)
+    return GenAI_rag.engine
+
+async def home(request):
+    """Health check endpoint"""
+    return JSONResponse({
+        "status": "online",
+        "message": "RAG Backend API is running (async)",
+        "endpoints": ["/upload", "/search", "/summarize", "/evaluate", "/cache", "/reload"]
+    })
+
+async def cache_stats(request):
+    """Semantic cache hit rate and time saved, plus LLM scheduler counters"""
+    engine = await engine_async()
+    return JSONResponse({
+        "status": "success",
+        "cache": engine.cache.summary(),
+        "llm": llm.summary()
+    })
+
+async def upload(request):
+    """Upload and process PDF document"""
+    try:
+        form = await request.form()
+        file = form.get("file")
+        if file is None or isinstance(file, str):
+            return JSONResponse({"error": "No file provided"}, status_code=400)
+        if not file.filename:
+            return JSONResponse({"error": "Empty filename"}, status_code=400)
+
+        path = os.path.join(UPLOAD_DIR, file.filename)
+        content = await file.read()
+
+        def save_and_ingest():
+            with open(path, "wb") as f:
+                f.write(content)
+            try:
+                get_engine().ingest_pdf(path, file.filename)
+            finally:
+                os.remove(path)
+
+        await run_cpu(save_and_ingest)
+        return JSONResponse({
+            "status": "success",
+            "message": "Document uploaded and processed successfully",
+            "filename": file.filename
+        })
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+async def reload_engine(request):
+    """Switch this worker to the active collection now (requires X-Admin-Token)"""
+    if not admin_authorized(request.headers.get("X-Admin-Token")):
+        return JSONResponse({"error": "Admin token required"}, status_code=403)
+    try:
+        GenAI_rag.engine = await run_cpu(SearchEngine)
+        return JSONResponse({
+            "status": "success",
+            "collection": GenAI_rag.engine.collection.name,
+            "chunks": GenAI_rag.engine.collection.count()
+        })
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+async def search(request):
+    """Search for relevant documents"""
+    try:
+        data = await read_json(request)
+        if not data or 'query' not in data:
+            return JSONResponse({"error": "Query parameter required"}, status_code=400)
+
+        # explain=true (body or query string) returns the search trace
+        explain = str(data.get("explain", request.query_params.get("explain", ""))).lower() in ("1", "true", "yes")
+        top_k = data.get("top_k", 5)
+        trace = QueryTrace(data["query"], top_k, use_cache=False) if explain else None
+
+        engine = await engine_async()
+        results = await run_cpu(engine.search, data["query"], top_k, trace=trace)
+        response = {
+            "status": "success",
+            "query": data["query"],
+            "results": results,
+            "count": len(results)
+        }
+        if trace is not None:
+            response["explain"] = trace.as_dict()
+        return JSONResponse(response)
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+async def summarize_api(request):
+    """Search and summarize relevant documents"""
+    try:
+        data = await read_json(request)
+        if not data or 'query' not in data:
+            return JSONResponse({"error": "Query parameter required"}, status_code=400)
+
+        # Near-duplicate queries reuse a cached summary
+        engine = await engine_async()
+        length = data.get("length", "medium")
+        q_emb = await run_cpu(engine.embedder.encode, data["query"])
+        cached = engine.cache.get(q_emb, ("summarize", length))
+
+        if cached is not None:
+            summary, source_chunks = cached
+        else:
+            generation = engine.cache.generation
+            start = time.perf_counter()
+
+            docs = await run_cpu(engine.get_context, data["query"], q_emb=q_emb)
+            if not docs:
+                return JSONResponse({
+                    "error": "No relevant documents found",
+                    "summary": "No documents available to summarize."
+                }, status_code=404)
+
+            summary = await summarize_async("\n\n".join(docs), length)
+            source_chunks = len(docs)
+            engine.cache.put(q_emb, ("summarize", length), (summary, source_chunks),
+                             time.perf_counter() - start, generation)
+
+        return JSONResponse({
+            "status": "success",
+            "query": data["query"],
+            "summary": summary,
+            "source_chunks": source_chunks,
+            "length": length
+        })
+    except LLMBusyError as e:
+        return JSONResponse({"error": str(e)}, status_code=503)
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+async def evaluate_case(engine, query, length, reference_summary, reference_doc):
+    """Search, summarize and score one query against optional references"""
+    retrieved_docs = await run_cpu(engine.get_context, query)
+    generated_summary = await summarize_async("\n\n".join(retrieved_docs), length)
+
+    result = {
+        "query": query,
+        "generated_summary": generated_summary,
+        "retrieved_chunks": len(retrieved_docs)
+    }
+    if reference_summary:
+        result["summary_metrics"] = {
+            "rouge": await run_cpu(calculate_rouge_scores, reference_summary, generated_summary),
+            "bleu": await run_cpu(calculate_bleu_score, reference_summary, generated_summary)
+        }
+    if reference_doc:
+        result["search_metrics"] = await run_cpu(evaluate_search_relevance, retrieved_docs, reference_doc)
+    return result
+
+async def evaluate(request):
+    """Evaluate summary quality and search relevance (same body as the Flask route)"""
+    try:
+        data = await read_json(request)
+        if not data or 'query' not in data:
+            return JSONResponse({"error": "Query parameter required"}, status_code=400)
+
+        engine = await engine_async()
+        evaluation_results = await evaluate_case(
+            engine, data["query"], data.get("length", "medium"),
+            data.get("reference_summary"), data.get("reference_doc")
+        )
+        return JSONResponse({
+            "status": "success",
+            "evaluation": evaluation_results
+        })
+    except LLMBusyError as e:
+        return JSONResponse({"error": str(e)}, status_code=503)
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+async def run_test_suite(request):
+    """
+    Run automated test suite with predefined queries; test cases run
+    concurrently, at most as many at once as the LLM scheduler runs calls
+    so a long suite waits its turn instead of overflowing the queue
+    """
+    try:
+        data = await read_json(request)
+        if not data or 'test_cases' not in data:
+            return JSONResponse({"error": "test_cases parameter required"}, status_code=400)
+
+        engine = await engine_async()
+        fan_out = asyncio.Semaphore(llm.max_concurrency)
+
+        async def run_case(case):
+            async with fan_out:
+                return await evaluate_case(engine, case.get("query"), "medium",
+                                           case.get("reference_summary", ""), case.get("expected_doc", ""))
+
+        evaluations = await asyncio.gather(*[run_case(case) for case in data["test_cases"]])
+
+        results = []
+        for evaluation in evaluations:
+            test_result = {
+                "query": evaluation["query"],
+                "retrieved_chunks": evaluation["retrieved_chunks"]
+            }
+            if "summary_metrics" in evaluation:
+                test_result["rouge_scores"] = evaluation["summary_metrics"]["rouge"]
+            if "search_metrics" in evaluation:
+                test_result["relevance_score"] = evaluation["search_metrics"]["relevance_score"]
+            results.append(test_result)
+
+        # JSONResponse rejects NaN, so an empty average is 0.0
+        rouge1 = [r.get('rouge_scores', {}).get('rouge1', {}).get('fmeasure', 0)
+                  for r in results if 'rouge_scores' in r]
+        relevance = [r.get('relevance_score', 0) for r in results]
+        avg_rouge1 = np.mean(rouge1) if rouge1 else 0.0
+        avg_relevance = np.mean(relevance) if relevance else 0.0
+
+        return JSONResponse({
+            "status": "success",
+            "test_results": results,
+            "summary_statistics": {
+                "total_tests": len(results),
+                "avg_rouge1_f1": float(avg_rouge1),
+                "avg_relevance_score": float(avg_relevance)
+            }
+        })
+    except LLMBusyError as e:
+        return JSONResponse({"error": str(e)}, status_code=503)
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+# ---------------- APP ----------------
+
+app = Starlette(
+    routes=[
+        Route("/", home, methods=["GET"]),
+        Route("/cache", cache_stats, methods=["GET"]),
+        Route("/upload", upload, methods=["POST"]),
+        Route("/reload", reload_engine, methods=["POST"]),
+        Route("/search", search, methods=["POST"]),
+        Route("/summarize", summarize_api, methods=["POST"]),
+        Route("/evaluate", evaluate, methods=["POST"]),
+        Route("/test", run_test_suite, methods=["POST"]),
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])]
+)
+
+if __name__ == "__main__":
+    port = int(os.getenv("PORT", 8000))
+
+    uvicorn.run(app, host="0.0.0.0", port=port)
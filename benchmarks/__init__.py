@@ -0,0 +1,11 @@
+"""
+Offline benchmarks for ingest, search and the HTTP API.
+
+Run from the repository root, e.g.
+
+    python -m benchmarks --out results/
+
+Everything runs CPU-only without network access: embeddings come from a
+feature-hashing embedder (pass --embedder minilm to use the real model if
+it is cached) and Gemini is replaced by a stub with configurable latency.
+"""
@@ -0,0 +1,27 @@
+"""Run every benchmark with small defaults and write one JSON file per benchmark"""
+import os
+import argparse
+
+from benchmarks import bench_ingest, bench_search, bench_routing, bench_quantized, load_test
+from benchmarks.common import write_results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--out", default="bench_results", help="output directory")
+    parser.add_argument("--embedder", choices=["hash", "minilm"], default="hash")
+    args = parser.parse_args()
+
+    write_results(os.path.join(args.out, "ingest.json"), "ingest", vars(args),
+                  bench_ingest.run([10, 50], embedder=args.embedder))
+    write_results(os.path.join(args.out, "search.json"), "search", vars(args),
+                  bench_search.run([500, 2000], queries=100, embedder=args.embedder))
+    write_results(os.path.join(args.out, "routing.json"), "routing", vars(args),
+                  bench_routing.run(30, [1, 3, 10], queries=50, embedder=args.embedder))
+    write_results(os.path.join(args.out, "quantized.json"), "quantized", vars(args),
+                  bench_quantized.run([2000], queries=100, embedder=args.embedder))
+    write_results(os.path.join(args.out, "load.json"), "load", vars(args),
+                  load_test.run([1, 8], requests_per_level=50, llm_latency=0.1,
+                                pages=20, embedder=args.embedder))
+
+if __name__ == "__main__":
+    main()
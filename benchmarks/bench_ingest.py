@@ -0,0 +1,54 @@
+"""
+Ingest throughput: synthetic PDFs of growing size through SearchEngine.ingest_pdf
+
+    python -m benchmarks.bench_ingest --pages 10 50 200 --out results/ingest.json
+    python -m benchmarks.bench_ingest --chunker words sentences
+"""
+import os
+import time
+import itertools
+import argparse
+import tempfile
+
+from benchmarks.common import make_pdf, make_vocab, make_engine, write_results
+
+def run(pages_list, words_per_page=600, embedder="hash", chunkers=("sentences",)):
+    vocab = make_vocab()
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for chunker, pages in itertools.product(chunkers, pages_list):
+            # Fresh engine per size so earlier documents don't skew TF-IDF refits
+            engine = make_engine(os.path.join(tmp, f"chroma_{chunker}_{pages}"), embedder)
+            engine.chunker = chunker
+            path = make_pdf(os.path.join(tmp, f"doc_{pages}.pdf"), pages,
+                            words_per_page=words_per_page, seed=pages, vocab=vocab)
+
+            start = time.perf_counter()
+            engine.ingest_pdf(path, f"doc_{pages}.pdf")
+            elapsed = time.perf_counter() - start
+
+            chunks = engine.collection.count()
+            results.append({
+                "chunker": chunker,
+                "pages": pages,
+                "chunks": chunks,
+                "seconds": elapsed,
+                "pages_per_second": pages / elapsed,
+                "chunks_per_page": chunks / pages
+            })
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pages", type=int, nargs="+", default=[10, 50, 200])
+    parser.add_argument("--words-per-page", type=int, default=600)
+    parser.add_argument("--embedder", choices=["hash", "minilm"], default="hash")
+    parser.add_argument("--chunker", choices=["sentences", "words"], nargs="+", default=["sentences"])
+    parser.add_argument("--out", help="JSON results path")
+    args = parser.parse_args()
+
+    results = run(args.pages, args.words_per_page, args.embedder, args.chunker)
+    write_results(args.out, "ingest", vars(args), results)
+
+if __name__ == "__main__":
+    main()
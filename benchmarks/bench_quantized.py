@@ -0,0 +1,105 @@
+"""
+Recall and latency of int8 quantized vector search against float32
+
+Grows a synthetic corpus, then compares SearchEngine.vector_rows with
+Chroma's float32 HNSW index, the int8 scan alone, and the int8 scan with a
+float rerank, all against exact float32 brute force.
+
+    python -m benchmarks.bench_quantized --chunks 5000 20000 --rerank-k 20 --out results/quantized.json
+"""
+import os
+import time
+import random
+import argparse
+import tempfile
+
+import numpy as np
+
+from benchmarks.common import make_vocab, make_sentences, make_engine, latency_stats, write_results
+from GenAI_rag import QuantizedIndex
+
+def grow_corpus(engine, target_chunks, vocab, pages_per_doc=50, words_per_page=600):
+    """Ingest synthetic page texts until the engine holds at least target_chunks"""
+    while len(engine.chunks) < target_chunks:
+        n = len(engine.boilerplate)
+        rng = random.Random(1000 + n)
+        pages = [make_sentences(rng, vocab, words_per_page) for _ in range(pages_per_doc)]
+        engine.ingest_pages(f"grow_{n}.pdf", f"hash_{n}", pages)
+
+def float_matrix(engine, page_size=1000):
+    """Float32 embeddings of every chunk, normalized, indexed by chunk store row"""
+    rows, embs = [], []
+    for offset in range(0, engine.collection.count(), page_size):
+        stored = engine.collection.get(include=["embeddings"], limit=page_size, offset=offset)
+        rows += [engine.chunks.row_of(chunk_id) for chunk_id in stored["ids"]]
+        embs.append(np.asarray(stored["embeddings"], dtype=np.float32))
+    matrix = np.zeros((len(engine.chunks), embs[0].shape[1]), dtype=np.float32)
+    matrix[rows] = np.concatenate(embs)
+    return matrix / (np.linalg.norm(matrix, axis=1, keepdims=True) + 1e-10)
+
+def make_chunk_queries(engine, n, seed=7):
+    """Short queries made of words from random chunks"""
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(n):
+        words = engine.chunks.text(rng.randrange(len(engine.chunks))).split()
+        start = rng.randrange(max(1, len(words) - 8))
+        queries.append(" ".join(words[start:start + 8]))
+    return queries
+
+def time_mode(engine, q_embs, exact, top_k):
+    latencies, recall = [], []
+    for q_emb, truth in zip(q_embs, exact):
+        start = time.perf_counter()
+        rows = engine.vector_rows(q_emb, top_k)
+        latencies.append(time.perf_counter() - start)
+        recall.append(len(set(rows) & truth) / len(truth))
+    return dict(latency_stats(latencies), recall=sum(recall) / len(recall))
+
+def run(chunk_sizes, queries=200, top_k=5, rerank_k=20, embedder="hash"):
+    vocab = make_vocab()
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = make_engine(os.path.join(tmp, "chroma"), embedder)
+        engine.quantized = QuantizedIndex()
+        quantized = engine.quantized
+
+        for target in sorted(chunk_sizes):
+            grow_corpus(engine, target, vocab)
+            matrix = float_matrix(engine)
+            query_set = make_chunk_queries(engine, queries)
+            q_embs = [np.asarray(engine.embedder.encode(q), dtype=np.float32) for q in query_set]
+            exact = [set(np.argsort(-(matrix @ (q / (np.linalg.norm(q) + 1e-10))))[:top_k].tolist())
+                     for q in q_embs]
+
+            runs = {}
+            for mode, index, k in (("chroma", None, 0), ("int8", quantized, 0),
+                                   ("int8+rerank", quantized, rerank_k)):
+                engine.quantized, engine.rerank_k = index, k
+                time_mode(engine, q_embs[:10], exact[:10], top_k)  # warm-up
+                runs[mode] = time_mode(engine, q_embs, exact, top_k)
+
+            results.append({
+                "chunks": len(engine.chunks),
+                "dim": matrix.shape[1],
+                "float32_bytes": matrix.nbytes,
+                "int8_bytes": quantized.nbytes,
+                "runs": runs
+            })
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--chunks", type=int, nargs="+", default=[5000, 20000])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--rerank-k", type=int, default=20, help="candidates re-scored in float")
+    parser.add_argument("--embedder", choices=["hash", "minilm"], default="hash")
+    parser.add_argument("--out", help="JSON results path")
+    args = parser.parse_args()
+
+    results = run(args.chunks, args.queries, args.top_k, args.rerank_k, args.embedder)
+    write_results(args.out, "quantized", vars(args), results)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Recall and latency of two-stage (document-routed) retrieval against flat search
+
+Builds a corpus of topical documents, then for each routing fan-out compares
+SearchEngine.retrieve results with the flat results for the same queries.
+
+    python -m benchmarks.bench_routing --docs 100 --fanout 1 2 5 10 --out results/routing.json
+"""
+import os
+import time
+import random
+import argparse
+import tempfile
+
+from benchmarks.common import (
+    make_pdf, make_vocab, sample_words, make_engine, latency_stats, write_results
+)
+
+def build_corpus(engine, tmp, n_docs, pages_per_doc, topic_words=200, common_words=100):
+    """Each document draws from its own topic vocabulary plus shared common words"""
+    vocab = make_vocab(size=common_words + n_docs * topic_words)
+    common = vocab[:common_words]
+    topics = []
+    for d in range(n_docs):
+        topic = vocab[common_words + d * topic_words:common_words + (d + 1) * topic_words]
+        topics.append(topic)
+        path = make_pdf(os.path.join(tmp, f"topic_{d}.pdf"), pages_per_doc,
+                        words_per_page=600, seed=d, vocab=topic + common)
+        engine.ingest_pdf(path, f"topic_{d}.pdf")
+        os.remove(path)
+    return topics
+
+def make_topic_queries(topics, n, seed=7):
+    rng = random.Random(seed)
+    return [" ".join(sample_words(rng, rng.choice(topics)[:50], rng.randint(2, 4))) for _ in range(n)]
+
+def timed_rows(engine, queries, top_k, route_docs, route_pages):
+    rows, latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        records = engine.retrieve(query, top_k, route_docs=route_docs, route_pages=route_pages)
+        latencies.append(time.perf_counter() - start)
+        rows.append({r["row"] for r in records})
+    return rows, latencies
+
+def run(n_docs, fanouts, route_pages=0, pages_per_doc=4, queries=100, top_k=5, embedder="hash"):
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = make_engine(os.path.join(tmp, "chroma"), embedder)
+        topics = build_corpus(engine, tmp, n_docs, pages_per_doc)
+        query_set = make_topic_queries(topics, queries)
+
+        timed_rows(engine, query_set[:10], top_k, 0, 0)  # warm-up
+        flat, flat_latency = timed_rows(engine, query_set, top_k, 0, 0)
+        results.append(dict(latency_stats(flat_latency), route_docs=0, route_pages=0, recall=1.0))
+
+        for fanout in fanouts:
+            routed, latency = timed_rows(engine, query_set, top_k, fanout, route_pages)
+            recall = [len(r & f) / len(f) for r, f in zip(routed, flat) if f]
+            results.append(dict(
+                latency_stats(latency),
+                route_docs=fanout,
+                route_pages=route_pages,
+                recall=sum(recall) / len(recall) if recall else 0.0
+            ))
+        chunks = engine.collection.count()
+    return {"chunks": chunks, "docs": n_docs, "runs": results}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--docs", type=int, default=100)
+    parser.add_argument("--pages-per-doc", type=int, default=4)
+    parser.add_argument("--fanout", type=int, nargs="+", default=[1, 2, 5, 10])
+    parser.add_argument("--route-pages", type=int, default=0, help="page fan-out (0 = doc routing only)")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--embedder", choices=["hash", "minilm"], default="hash")
+    parser.add_argument("--out", help="JSON results path")
+    args = parser.parse_args()
+
+    results = run(args.docs, args.fanout, args.route_pages, args.pages_per_doc,
+                  args.queries, args.top_k, args.embedder)
+    write_results(args.out, "routing", vars(args), results)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Search latency and QPS of SearchEngine.search as the corpus grows
+
+    python -m benchmarks.bench_search --chunks 1000 5000 20000 --out results/search.json
+"""
+import os
+import time
+import argparse
+import tempfile
+
+from benchmarks.common import (
+    make_pdf, make_vocab, make_queries, make_engine, latency_stats, write_results
+)
+
+def grow_corpus(engine, target_chunks, tmp, vocab, pages_per_doc=50, words_per_page=600):
+    """Ingest synthetic PDFs until the engine holds at least target_chunks"""
+    while engine.collection.count() < target_chunks:
+        n = len(engine.boilerplate)
+        path = make_pdf(os.path.join(tmp, f"grow_{n}.pdf"), pages_per_doc,
+                        words_per_page=words_per_page, seed=1000 + n, vocab=vocab)
+        engine.ingest_pdf(path, f"grow_{n}.pdf")
+        os.remove(path)
+
+def time_queries(engine, queries, top_k):
+    latencies = []
+    start = time.perf_counter()
+    for query in queries:
+        t0 = time.perf_counter()
+        engine.search(query, top_k)
+        latencies.append(time.perf_counter() - t0)
+    total = time.perf_counter() - start
+    return latencies, total
+
+def run(chunk_sizes, queries=200, top_k=5, embedder="hash"):
+    vocab = make_vocab()
+    query_set = make_queries(queries, vocab=vocab)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = make_engine(os.path.join(tmp, "chroma"), embedder)
+        for target in sorted(chunk_sizes):
+            grow_corpus(engine, target, tmp, vocab)
+            time_queries(engine, query_set[:10], top_k)  # warm-up
+            latencies, total = time_queries(engine, query_set, top_k)
+            results.append(dict(
+                latency_stats(latencies),
+                chunks=engine.collection.count(),
+                qps=len(query_set) / total
+            ))
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--chunks", type=int, nargs="+", default=[1000, 5000, 20000])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--embedder", choices=["hash", "minilm"], default="hash")
+    parser.add_argument("--out", help="JSON results path")
+    args = parser.parse_args()
+
+    results = run(args.chunks, args.queries, args.top_k, args.embedder)
+    write_results(args.out, "search", vars(args), results)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""
+Shared helpers for the offline benchmarks: synthetic PDFs, an offline
+embedder, a stub LLM, timing statistics and JSON result files.
+"""
+import os
+import sys
+import json
+import time
+import zlib
+import random
+import platform
+import threading
+import subprocess
+
+import numpy as np
+import fitz
+
+# Benchmarks run from the repo root or from benchmarks/
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import GenAI_rag  # noqa: E402
+
+VOCAB_SEED = 1234
+
+# ---------------- SYNTHETIC DATA ----------------
+
+def make_vocab(size=5000, seed=VOCAB_SEED):
+    """Pseudo-words with a Zipf-like frequency when sampled by rank"""
+    rng = random.Random(seed)
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(letters) for _ in range(rng.randint(3, 10))))
+    return sorted(words)
+
+def sample_words(rng, vocab, n):
+    """n words drawn with Zipf-like weights (rank r has weight 1/r)"""
+    weights = [1.0 / (r + 1) for r in range(len(vocab))]
+    return rng.choices(vocab, weights=weights, k=n)
+
+def make_sentences(rng, vocab, n_words):
+    """Text of roughly n_words words split into sentences"""
+    words = sample_words(rng, vocab, n_words)
+    out, i = [], 0
+    while i < len(words):
+        length = rng.randint(8, 25)
+        sentence = " ".join(words[i:i + length])
+        out.append(sentence[:1].upper() + sentence[1:] + ".")
+        i += length
+    return " ".join(out)
+
+def make_pdf(path, pages, words_per_page=600, seed=0, vocab=None):
+    """Write a synthetic PDF with a running header and footer on every page"""
+    rng = random.Random(seed)
+    vocab = vocab or make_vocab()
+    doc = fitz.open()
+    for number in range(pages):
+        page = doc.new_page()
+        rect = page.rect
+        page.insert_text((36, 30), "Synthetic Benchmark Corpus - Internal", fontsize=8)
+        page.insert_textbox(
+            fitz.Rect(36, 48, rect.width - 36, rect.height - 48),
+            make_sentences(rng, vocab, words_per_page),
+            fontsize=6
+        )
+        page.insert_text((36, rect.height - 24), f"Page {number + 1} of {pages}", fontsize=8)
+    doc.save(path)
+    doc.close()
+    return path
+
+def make_queries(n, seed=99, vocab=None):
+    """Short keyword queries drawn from the corpus vocabulary"""
+    rng = random.Random(seed)
+    vocab = vocab or make_vocab()
+    return [" ".join(sample_words(rng, vocab[:2000], rng.randint(2, 5))) for _ in range(n)]
+
+# ---------------- OFFLINE MODELS ----------------
+
+class HashEmbedder:
+    """
+    Deterministic feature-hashing embedder with the SentenceTransformer
+    encode() interface, so benchmarks run without downloading a model
+    """
+    def __init__(self, dim=384):
+        self.dim = dim
+
+    def _encode_one(self, text):
+        vec = np.zeros(self.dim, dtype=np.float32)
+        for token in text.lower().split():
+            h = zlib.crc32(token.encode("utf-8"))
+            vec[h % self.dim] += 1.0 if (h >> 16) & 1 else -1.0
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+    def encode(self, texts, **kwargs):
+        if isinstance(texts, str):
+            return self._encode_one(texts)
+        return np.stack([self._encode_one(t) for t in texts]) if texts else np.zeros((0, self.dim))
+
+def make_embedder(name):
+    """'hash' (offline, default) or 'minilm' (needs the model in the local cache)"""
+    if name == "hash":
+        return HashEmbedder()
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer("all-MiniLM-L6-v2")
+
+def make_engine(chroma_dir, embedder="hash"):
+    """SearchEngine on a scratch Chroma directory with the semantic cache disabled"""
+    engine = GenAI_rag.SearchEngine(
+        chroma_dir=chroma_dir,
+        embedder=make_embedder(embedder),
+        text_store=GenAI_rag.TextStore(chroma_dir + "_text")
+    )
+    engine.cache = GenAI_rag.SemanticCache(max_size=0)
+    return engine
+
+def stub_generate(latency=0.5, rate_limit_rate=0.0, seed=0):
+    """
+    Replacement for GenAI_rag.generate that sleeps instead of calling Gemini
+    and raises the provider's 429 error with probability rate_limit_rate
+    """
+    from google.api_core import exceptions as google_exceptions
+
+    rng = random.Random(seed)
+    lock = threading.Lock()
+
+    def generate(prompt):
+        time.sleep(latency)
+        with lock:
+            limited = rng.random() < rate_limit_rate
+        if limited:
+            raise google_exceptions.ResourceExhausted("Stub rate limit")
+        return " ".join(prompt.split()[-100:])
+    return generate
+
+def stub_generate_async(latency=0.5, rate_limit_rate=0.0, seed=0):
+    """Awaitable stub_generate for asgi_app.generate_async"""
+    import asyncio
+    from google.api_core import exceptions as google_exceptions
+
+    rng = random.Random(seed)
+
+    async def generate_async(prompt):
+        await asyncio.sleep(latency)
+        if rng.random() < rate_limit_rate:
+            raise google_exceptions.ResourceExhausted("Stub rate limit")
+        return " ".join(prompt.split()[-100:])
+    return generate_async
+
+# ---------------- RESULTS ----------------
+
+def latency_stats(samples):
+    """p50/p90/p99/mean/max in milliseconds for a list of seconds"""
+    if not samples:
+        return {}
+    ms = np.asarray(samples) * 1000.0
+    return {
+        "count": int(ms.size),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p90_ms": float(np.percentile(ms, 90)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "max_ms": float(ms.max())
+    }
+
+def environment():
+    """Machine and code version the numbers were measured on"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+            capture_output=True, text=True, timeout=5
+        ).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        commit = ""
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count()
+    }
+
+def write_results(path, name, params, results):
+    """Write {"benchmark", "environment", "params", "results"} as JSON"""
+    payload = {
+        "benchmark": name,
+        "environment": environment(),
+        "params": params,
+        "results": results
+    }
+    if path:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(payload, f, indent=2)
+    print(json.dumps(payload, indent=2))
+    return payload
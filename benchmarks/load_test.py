@@ -0,0 +1,149 @@
+"""
+Concurrent load against the Flask and/or ASGI app with a stub LLM backend
+
+Starts the real app on a local port (Gemini replaced by a sleep that can
+inject rate-limit errors), then drives a /search + /summarize mix at each
+concurrency level. --hot-queries repeats a small query set to exercise
+single-flight coalescing of identical LLM calls; --server flask asgi runs
+the same load against both serving modes for comparison.
+
+    python -m benchmarks.load_test --concurrency 1 8 32 --out results/load.json
+    python -m benchmarks.load_test --concurrency 64 --rate-limit-rate 0.2 --hot-queries 5
+    python -m benchmarks.load_test --server flask asgi --concurrency 16 64 256 --summarize-ratio 1
+"""
+import os
+import time
+import socket
+import random
+import argparse
+import tempfile
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from werkzeug.serving import make_server
+
+from benchmarks.common import (
+    GenAI_rag, make_pdf, make_vocab, make_queries, make_engine, stub_generate,
+    stub_generate_async, latency_stats, write_results
+)
+
+def start_flask(llm_latency, rate_limit_rate):
+    """Serve the Flask app on a free local port; returns (stop, base url, scheduler)"""
+    GenAI_rag.generate = stub_generate(llm_latency, rate_limit_rate)
+    GenAI_rag.llm = GenAI_rag.LLMScheduler()
+    server = make_server("127.0.0.1", 0, GenAI_rag.app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server.shutdown, f"http://127.0.0.1:{server.server_port}", GenAI_rag.llm
+
+def start_asgi(llm_latency, rate_limit_rate):
+    """Serve the ASGI app with uvicorn on a free local port"""
+    import uvicorn
+    import asgi_app
+
+    asgi_app.generate_async = stub_generate_async(llm_latency, rate_limit_rate)
+    asgi_app.llm = asgi_app.AsyncLLMScheduler()
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(asgi_app.app, host="127.0.0.1", port=port,
+                                           log_level="warning", backlog=4096))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+
+    def stop():
+        server.should_exit = True
+        thread.join()
+    return stop, f"http://127.0.0.1:{port}", asgi_app.llm
+
+SERVERS = {"flask": start_flask, "asgi": start_asgi}
+
+def one_request(session, base, query, summarize_ratio, rng):
+    if rng.random() < summarize_ratio:
+        url, body = f"{base}/summarize", {"query": query, "length": "short"}
+    else:
+        url, body = f"{base}/search", {"query": query, "top_k": 5}
+    start = time.perf_counter()
+    try:
+        status = session.post(url, json=body, timeout=120).status_code
+    except requests.RequestException:
+        status = 0
+    return time.perf_counter() - start, status
+
+def drive(base, queries, concurrency, requests_per_level, summarize_ratio):
+    """Fire requests_per_level requests from concurrency client threads"""
+    local = threading.local()
+
+    def worker(i):
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        rng = random.Random(i)
+        return one_request(local.session, base, queries[i % len(queries)], summarize_ratio, rng)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(worker, range(requests_per_level)))
+    total = time.perf_counter() - start
+
+    latencies = [t for t, status in outcomes if status == 200]
+    statuses = Counter(str(status) for _, status in outcomes)
+    return dict(
+        latency_stats(latencies),
+        concurrency=concurrency,
+        requests=requests_per_level,
+        errors=requests_per_level - statuses.get("200", 0),
+        status_codes=dict(statuses),
+        # Only 200s count as served; rejected requests come back fast
+        throughput_rps=statuses.get("200", 0) / total,
+        request_rate_rps=requests_per_level / total
+    )
+
+def run(levels, requests_per_level=200, summarize_ratio=0.5, llm_latency=0.5,
+        pages=50, embedder="hash", rate_limit_rate=0.0, hot_queries=0, servers=("flask",)):
+    vocab = make_vocab()
+    queries = make_queries(max(hot_queries or requests_per_level, 1), vocab=vocab)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        GenAI_rag.engine = make_engine(os.path.join(tmp, "chroma"), embedder)
+        path = make_pdf(os.path.join(tmp, "corpus.pdf"), pages, vocab=vocab)
+        GenAI_rag.engine.ingest_pdf(path, "corpus.pdf")
+
+        for name in servers:
+            for level in levels:
+                # Fresh server and scheduler per level so counters don't mix
+                stop, base, scheduler = SERVERS[name](llm_latency, rate_limit_rate)
+                try:
+                    result = drive(base, queries, level, requests_per_level, summarize_ratio)
+                finally:
+                    stop()
+                results.append(dict(result, server=name, llm=scheduler.summary()))
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--server", choices=sorted(SERVERS), nargs="+", default=["flask"])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=200, help="requests per level")
+    parser.add_argument("--summarize-ratio", type=float, default=0.5)
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="stub LLM seconds")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0,
+                        help="probability the stub LLM returns a 429")
+    parser.add_argument("--hot-queries", type=int, default=0,
+                        help="draw requests from this many queries (0 = all distinct)")
+    parser.add_argument("--pages", type=int, default=50, help="corpus size in pages")
+    parser.add_argument("--embedder", choices=["hash", "minilm"], default="hash")
+    parser.add_argument("--out", help="JSON results path")
+    args = parser.parse_args()
+
+    results = run(args.concurrency, args.requests, args.summarize_ratio,
+                  args.llm_latency, args.pages, args.embedder,
+                  args.rate_limit_rate, args.hot_queries, args.server)
+    write_results(args.out, "load", vars(args), results)
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,16 @@
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
 import json
 
 # Get backend URL from secrets (or fallback to localhost for local dev)
 #BACKEND = st.secrets.get("BACKEND_URL", "http://localhost:8000")
 BACKEND = "http://localhost:8000"
+
+# Seconds to reuse search/summary results and the health check across reruns
+CACHE_TTL = 300
+HEALTH_TTL = 30
+
 # Page configuration
 st.set_page_config(
     page_title="RAG Document Assistant",
@@ -78,6 +84,45 @@ st.markdown("""
     </style>
 """, unsafe_allow_html=True)
 
+# ---------------- BACKEND CLIENT ----------------
+
+class BackendError(Exception):
+    """Non-200 response from the backend (raised so it is never cached)"""
+
+@st.cache_resource
+def get_session():
+    """Shared keep-alive session with a connection pool to the backend"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def post_json(path, payload, timeout):
+    """POST to the backend and return the JSON body, raising BackendError on failure"""
+    res = get_session().post(f"{BACKEND}{path}", json=payload, timeout=timeout)
+    if res.status_code != 200:
+        raise BackendError(res.json().get('error', 'Unknown error'))
+    return res.json()
+
+@st.cache_data(ttl=HEALTH_TTL, show_spinner=False)
+def backend_status():
+    """Status code of the health check, or None if the backend is unreachable"""
+    try:
+        return get_session().get(f"{BACKEND}/", timeout=5).status_code
+    except requests.exceptions.RequestException:
+        return None
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def cached_search(query, top_k):
+    """Search results keyed by (query, top_k)"""
+    return post_json("/search", {"query": query, "top_k": top_k}, timeout=30)
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def cached_summary(query, length):
+    """Summary results keyed by (query, length)"""
+    return post_json("/summarize", {"query": query, "length": length}, timeout=60)
+
 # Initialize session state
 if 'uploaded_docs' not in st.session_state:
     st.session_state.uploaded_docs = []
@@ -109,14 +154,13 @@ with st.sidebar:
     st.markdown("---")
     
     # Backend status check
-    try:
-        response = requests.get(f"{BACKEND}/", timeout=5)
-        if response.status_code == 200:
-            st.success("🟢 Backend Online")
-        else:
-            st.error("🔴 Backend Error")
-    except:
+    status = backend_status()
+    if status == 200:
+        st.success("🟢 Backend Online")
+    elif status is None:
         st.error("🔴 Backend Offline")
+    else:
+        st.error("🔴 Backend Error")
     
     st.markdown("---")
     st.info("💡 Upload a PDF and ask questions to get AI-powered insights!")
@@ -161,7 +205,7 @@ with tab1:
             if st.button("🚀 Process Document", key="process_tab1"):
                 with st.spinner("🔄 Processing document..."):
                     try:
-                        r = requests.post(
+                        r = get_session().post(
                             f"{BACKEND}/upload",
                             files={"file": file},
                             timeout=60
@@ -169,6 +213,9 @@ with tab1:
                         if r.status_code == 200:
                             st.success("✅ Document processed successfully!")
                             st.session_state.uploaded_docs.append(file.name)
+                            # New content invalidates previously cached answers
+                            cached_search.clear()
+                            cached_summary.clear()
                             st.balloons()
                         else:
                             st.error(f"❌ Upload failed: {r.json().get('error', 'Unknown error')}")
@@ -209,38 +256,29 @@ with tab1:
         else:
             with st.spinner("🤔 Searching documents and generating summary..."):
                 try:
-                    res = requests.post(
-                        f"{BACKEND}/summarize",
-                        json={"query": query, "length": length},
-                        timeout=60
-                    )
+                    result = cached_summary(query, length)
+                    summary = result["summary"]
+                    st.session_state.last_summary = summary
                     
-                    if res.status_code == 200:
-                        result = res.json()
-                        summary = result["summary"]
-                        st.session_state.last_summary = summary
-                        
-                        st.markdown("---")
-                        st.subheader("📋 Summary")
-                        st.markdown(f'<div class="summary-box">{summary}</div>', unsafe_allow_html=True)
-                        
-                        # Additional info
-                        col_info1, col_info2, col_info3 = st.columns(3)
-                        with col_info1:
-                            st.metric("Query", "✅ Completed")
-                        with col_info2:
-                            st.metric("Length", length.capitalize())
-                        with col_info3:
-                            st.metric("Words", len(summary.split()))
-                        
-                        # Source chunks info
-                        if 'source_chunks' in result:
-                            st.info(f"📚 Generated from {result['source_chunks']} relevant document chunks")
-                            
-                    else:
-                        error_msg = res.json().get('error', 'Unknown error')
-                        st.error(f"❌ Failed to generate summary: {error_msg}")
+                    st.markdown("---")
+                    st.subheader("📋 Summary")
+                    st.markdown(f'<div class="summary-box">{summary}</div>', unsafe_allow_html=True)
+                    
+                    # Additional info
+                    col_info1, col_info2, col_info3 = st.columns(3)
+                    with col_info1:
+                        st.metric("Query", "✅ Completed")
+                    with col_info2:
+                        st.metric("Length", length.capitalize())
+                    with col_info3:
+                        st.metric("Words", len(summary.split()))
+                    
+                    # Source chunks info
+                    if 'source_chunks' in result:
+                        st.info(f"📚 Generated from {result['source_chunks']} relevant document chunks")
                         
+                except BackendError as e:
+                    st.error(f"❌ Failed to generate summary: {e}")
                 except requests.exceptions.Timeout:
                     st.error("⏱️ Request timed out. Please try again.")
                 except Exception as e:
@@ -267,24 +305,17 @@ with tab2:
         else:
             with st.spinner("🔍 Searching..."):
                 try:
-                    res = requests.post(
-                        f"{BACKEND}/search",
-                        json={"query": search_query, "top_k": top_k},
-                        timeout=30
-                    )
+                    result = cached_search(search_query, top_k)
+                    results = result.get("results", [])
                     
-                    if res.status_code == 200:
-                        result = res.json()
-                        results = result.get("results", [])
-                        
-                        st.success(f"✅ Found {len(results)} relevant chunks")
-                        
-                        for i, chunk in enumerate(results, 1):
-                            with st.expander(f"📄 Result {i}"):
-                                st.markdown(chunk)
-                    else:
-                        st.error(f"❌ Search failed: {res.json().get('error', 'Unknown error')}")
+                    st.success(f"✅ Found {len(results)} relevant chunks")
+                    
+                    for i, chunk in enumerate(results, 1):
+                        with st.expander(f"📄 Result {i}"):
+                            st.markdown(chunk)
                         
+                except BackendError as e:
+                    st.error(f"❌ Search failed: {e}")
                 except Exception as e:
                     st.error(f"❌ Error: {str(e)}")
 
@@ -345,7 +376,7 @@ with tab3:
                     if reference_doc:
                         eval_data["reference_doc"] = reference_doc
                     
-                    res = requests.post(
+                    res = get_session().post(
                         f"{BACKEND}/evaluate",
                         json=eval_data,
                         timeout=60
@@ -469,7 +500,7 @@ with tab4:
             test_cases = json.loads(test_cases_input)
             
             with st.spinner("🧪 Running tests..."):
-                res = requests.post(
+                res = get_session().post(
                     f"{BACKEND}/test",
                     json={"test_cases": test_cases},
                     timeout=120
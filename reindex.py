@@ -0,0 +1,209 @@
+"""
+Rebuild the vector and lexical indexes from the extracted-text store
+
+    python reindex.py --collection docs_v2 --chunk-size 300 --chunk-overlap 30 --workers 4
+
+Documents are processed in batches. Worker processes chunk and embed; this
+process writes each finished batch to Chroma and checkpoints its documents,
+so an interrupted run resumes where it stopped when started again with the
+same arguments. The text store is re-listed until no new uploads remain;
+when a name was uploaded more than once only its newest text is indexed.
+
+The new collection becomes active only if it covers every document in the
+current one (documents ingested before the text store existed can't be
+rebuilt); --force activates it anyway. Backend workers switch to it within
+ACTIVE_CHECK_INTERVAL seconds and rebuild their TF-IDF index from it.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import multiprocessing as mp
+
+import numpy as np
+
+from GenAI_rag import (
+    CHROMA_DIR, TEXT_STORE_DIR, EMBED_MODEL, CHUNK_SIZE, CHUNK_OVERLAP, CHUNKER,
+    TextStore, chunk_document, add_chunks, add_centroids, centroid_collections,
+    active_collection, set_active_collection
+)
+
+REINDEX_DIR = "./reindex_state"
+
+# ---------------- WORKERS ----------------
+
+_worker = {}
+
+def init_worker(model, chunk_size, chunk_overlap, chunker, store_root):
+    """Load the embedder once per worker process"""
+    from sentence_transformers import SentenceTransformer
+    _worker["embedder"] = SentenceTransformer(model)
+    _worker["store"] = TextStore(store_root)
+    _worker["chunking"] = (chunk_size, chunk_overlap, chunker)
+
+def embed_batch(hashes):
+    """Chunk and embed one batch of documents"""
+    size, overlap, chunker = _worker["chunking"]
+    ids, texts, metas = [], [], []
+    for doc_hash in hashes:
+        doc = _worker["store"].get(doc_hash)
+        doc_ids, doc_texts, doc_metas = chunk_document(doc["name"], doc_hash, doc["pages"],
+                                                       size, overlap, chunker)
+        ids += doc_ids
+        texts += doc_texts
+        metas += doc_metas
+    embeddings = _worker["embedder"].encode(texts) if texts else np.zeros((0, 0), dtype=np.float32)
+    return hashes, ids, texts, np.asarray(embeddings, dtype=np.float32), metas
+
+# ---------------- CHECKPOINTS ----------------
+
+class Checkpoint:
+    """Indexed document hashes for one target collection, one marker file each"""
+    def __init__(self, collection, config):
+        self.root = os.path.join(REINDEX_DIR, collection)
+        os.makedirs(os.path.join(self.root, "done"), exist_ok=True)
+
+        config_path = os.path.join(self.root, "config.json")
+        if os.path.exists(config_path):
+            with open(config_path) as f:
+                saved = json.load(f)
+            if saved != config:
+                sys.exit(f"Checkpoint in {self.root} was made with {saved}; "
+                         f"use the same arguments or a new --collection")
+        else:
+            with open(config_path, "w") as f:
+                json.dump(config, f, indent=2)
+
+    def done(self):
+        return set(os.listdir(os.path.join(self.root, "done")))
+
+    def mark(self, hashes):
+        for doc_hash in hashes:
+            open(os.path.join(self.root, "done", doc_hash), "w").close()
+
+# ---------------- DOCUMENTS ----------------
+
+def latest_per_name(store):
+    """
+    Newest stored hash for every document name, plus the older hashes it
+    supersedes (their chunk ids would collide with the newer ones)
+    """
+    newest, superseded = {}, []
+    hashes = sorted(store.hashes(), key=lambda h: os.path.getmtime(store.path(h)))
+    for doc_hash in hashes:
+        name = store.name(doc_hash)
+        if name in newest:
+            superseded.append(newest[name])
+        newest[name] = doc_hash
+    return newest, superseded
+
+def collection_docs(collection, page_size=1000):
+    """Document names in a collection"""
+    names = set()
+    for offset in range(0, collection.count(), page_size):
+        stored = collection.get(include=["metadatas"], limit=page_size, offset=offset)
+        names.update((meta or {}).get("doc") for meta in stored["metadatas"])
+    names.discard(None)
+    return names
+
+# ---------------- MAIN ----------------
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--collection", required=True, help="name of the new collection")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--chunk-overlap", type=int, default=CHUNK_OVERLAP)
+    parser.add_argument("--chunker", choices=["sentences", "words"], default=CHUNKER)
+    parser.add_argument("--model", default=EMBED_MODEL, help="SentenceTransformer model")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) - 1))
+    parser.add_argument("--batch-docs", type=int, default=8, help="documents per batch")
+    parser.add_argument("--chroma-dir", default=CHROMA_DIR)
+    parser.add_argument("--text-store", default=TEXT_STORE_DIR)
+    parser.add_argument("--no-activate", action="store_true",
+                        help="build the collection but keep the current one active")
+    parser.add_argument("--force", action="store_true",
+                        help="activate even if documents of the current collection are missing")
+    args = parser.parse_args()
+
+    current = active_collection(args.chroma_dir)
+    if args.collection == current:
+        sys.exit(f"'{args.collection}' is the active collection; choose a new name")
+
+    import chromadb
+    settings = {
+        "chunk_size": args.chunk_size,
+        "chunk_overlap": args.chunk_overlap,
+        "chunker": args.chunker,
+        "embed_model": args.model
+    }
+    client = chromadb.PersistentClient(path=args.chroma_dir)
+    collection = client.get_or_create_collection(args.collection, metadata=settings)
+    doc_centroids, page_centroids = centroid_collections(client, args.collection)
+    checkpoint = Checkpoint(args.collection, settings)
+
+    store = TextStore(args.text_store)
+    start = time.perf_counter()
+    initargs = (args.model, args.chunk_size, args.chunk_overlap, args.chunker, args.text_store)
+    pool, local = None, False
+
+    try:
+        # Re-list the store after each pass: uploads to the current
+        # collection keep arriving while this one is built
+        while True:
+            newest, superseded = latest_per_name(store)
+            done = checkpoint.done()
+            todo = [h for h in newest.values() if h not in done]
+            if not todo:
+                break
+            pending = [todo[i:i + args.batch_docs] for i in range(0, len(todo), args.batch_docs)]
+            print(f"{len(newest)} documents, {len(todo)} to index in {len(pending)} batches")
+            for doc_hash in superseded:
+                print(f"  skipping {doc_hash[:12]}: superseded by a newer upload of the same name")
+
+            if pool is None and args.workers > 1 and len(pending) > 1:
+                # spawn: forked workers inherit torch thread pools and can deadlock
+                pool = mp.get_context("spawn").Pool(args.workers, init_worker, initargs)
+            if pool is not None:
+                results = pool.imap_unordered(embed_batch, pending)
+            else:
+                if not local:
+                    init_worker(*initargs)
+                    local = True
+                results = map(embed_batch, pending)
+
+            for n, (batch, ids, texts, embeddings, metas) in enumerate(results, 1):
+                # A re-uploaded name replaces the chunks of its older text
+                for doc_hash in batch:
+                    name = store.name(doc_hash)
+                    collection.delete(where={"$and": [{"doc": name}, {"doc_hash": {"$ne": doc_hash}}]})
+                    page_centroids.delete(where={"doc": name})
+                # Upsert: a batch interrupted before its markers is simply rewritten
+                add_chunks(collection, ids, texts, embeddings, metas, upsert=True)
+                add_centroids(doc_centroids, page_centroids, embeddings, metas)
+                checkpoint.mark(batch)
+                print(f"[{n}/{len(pending)}] {len(batch)} documents, {len(ids)} chunks "
+                      f"({time.perf_counter() - start:.1f}s)")
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+    print(f"Collection '{args.collection}' complete: {collection.count()} chunks")
+    if args.no_activate:
+        return
+
+    missing = sorted(collection_docs(client.get_or_create_collection(current)) - set(newest))
+    if missing:
+        print(f"{len(missing)} documents in '{current}' have no stored text and are not in "
+              f"'{args.collection}' (re-upload them to include them):")
+        for name in missing:
+            print(f"  {name}")
+        if not args.force:
+            sys.exit(f"Not activating '{args.collection}'; pass --force to activate without them")
+
+    set_active_collection(args.collection, args.chroma_dir)
+    print(f"Active collection is now '{args.collection}'; backend workers switch to it "
+          f"within ACTIVE_CHECK_INTERVAL seconds")
+
+if __name__ == "__main__":
+    main()